@@ -0,0 +1,84 @@
+# coding=utf-8
+"""Background loading of meshes and images, so parsing overlaps window and GL setup"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from lib.texture_cache import load_cached_texture
+
+
+def _decodeImage(filename):
+    image = Image.open(filename)
+
+    # Image.open is lazy, load() forces the actual decoding inside the worker
+    image.load()
+    return image
+
+
+class AssetPreloader:
+    """
+    Parses meshes and decodes images in a thread pool.
+    Results are requested by name from the thread owning the GL context,
+    which is the only one that should upload them to the GPU.
+    """
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.start = time.perf_counter()
+        self.futures = {}
+        self.timings = {}
+        self.waited = 0.0
+
+    def _timed(self, name, function, *args, **kwargs):
+        begin = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings[name] = (begin - self.start, time.perf_counter() - self.start)
+        return result
+
+    def addMesh(self, name, loader, *args, **kwargs):
+        """Schedules loader(*args, **kwargs), it must return a Shape"""
+        assert name not in self.futures, f"Asset {name} was already scheduled."
+        self.futures[name] = self.executor.submit(self._timed, name, loader, *args, **kwargs)
+
+    def addImage(self, name, filename):
+        """Schedules the decoding of an image file into a PIL Image"""
+        assert name not in self.futures, f"Asset {name} was already scheduled."
+        self.futures[name] = self.executor.submit(self._timed, name, _decodeImage, filename)
+
+    def addTexture(self, name, filename, mipmaps=False):
+        """Schedules texture_cache.load_cached_texture, decoded pixels ready for upload"""
+        assert name not in self.futures, f"Asset {name} was already scheduled."
+        self.futures[name] = self.executor.submit(self._timed, name, load_cached_texture, filename, mipmaps)
+
+    def get(self, name):
+        """Returns a loaded asset, blocking until it is ready"""
+        future = self.futures[name]
+
+        begin = time.perf_counter()
+        result = future.result()
+        self.waited += time.perf_counter() - begin
+
+        return result
+
+    # Aliases to make the kind of the requested asset explicit at the call site
+    mesh = get
+    image = get
+    texture = get
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def report(self):
+        """Prints how long each asset took and how long the main thread waited for them"""
+        elapsed = time.perf_counter() - self.start
+
+        print("Asset loading report (ms, relative to preloader start)")
+        for name, (begin, end) in sorted(self.timings.items(), key=lambda item: item[1][1]):
+            print(f"  {name:<20} {1000 * begin:8.1f} -> {1000 * end:8.1f}  ({1000 * (end - begin):.1f})")
+
+        if self.timings:
+            lastEnd = max(end for _, end in self.timings.values())
+            print(f"  all assets ready at {1000 * lastEnd:.1f}")
+
+        print(f"  main thread blocked {1000 * self.waited:.1f} of {1000 * elapsed:.1f}")
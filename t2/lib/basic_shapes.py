@@ -8,51 +8,73 @@ import sys
 import os.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from lib.assets_path import getAssetPath
+from lib.mesh_loader import load_mesh
+import lib.vertex_cache as vc
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
 # A simple class container to store vertices and indices that define a shape
+# Vertices are kept as a flat contiguous float32 array and indices as uint32,
+# stride is the number of floats per vertex, when known
 class Shape:
-    def __init__(self, vertices, indices):
-        self.vertices = vertices
-        self.indices = indices
+    def __init__(self, vertices, indices, stride=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1)
+        self.indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
+        self.stride = stride
 
     def __str__(self):
         return "vertices: " + str(self.vertices) + "\n"\
             "indices: " + str(self.indices)
 
+    def optimizeVertexCache(self, stride=None, cacheSize=vc.CACHE_SIZE, submeshes=None, report=False):
+        """Copy of this indexed triangle shape reordered for the vertex cache, see vertex_cache.optimizeVertexCache"""
+        stride = self.stride if stride is None else stride
+        assert stride is not None, "The vertex stride of this shape is unknown, please provide it."
+
+        optimized = vc.optimizeVertexCache(self, stride, cacheSize, submeshes, report)
+        return Shape(optimized.vertices, optimized.indices, stride)
+
     
 
 
 def merge(destinationShape, strideSize, sourceShape):
 
     # current vertices are an offset for indices refering to vertices of the new shape
-    offset = len(destinationShape.vertices)
-    destinationShape.vertices += sourceShape.vertices
-    destinationShape.indices += [(offset/strideSize) + index for index in sourceShape.indices]
+    offset = len(destinationShape.vertices) // strideSize
+    destinationShape.vertices = np.concatenate((destinationShape.vertices, sourceShape.vertices))
+    destinationShape.indices = np.concatenate((destinationShape.indices, sourceShape.indices + np.uint32(offset)))
 
 
-def applyOffset(shape, stride, offset):
+def mergeMany(shapes, strideSize):
+    """Concatenates all the shapes into a new one, allocating its arrays once"""
 
-    numberOfVertices = len(shape.vertices)//stride
+    vertexCounts = np.array([len(shape.vertices) // strideSize for shape in shapes], dtype=np.uint32)
+    indexCounts = [len(shape.indices) for shape in shapes]
 
-    for i in range(numberOfVertices):
-        index = i * stride
-        shape.vertices[index]     += offset[0]
-        shape.vertices[index + 1] += offset[1]
-        shape.vertices[index + 2] += offset[2]
+    # Every shape indices are displaced by the vertices of the shapes before it
+    offsets = np.repeat(np.cumsum(vertexCounts) - vertexCounts, indexCounts)
 
+    vertices = np.concatenate([shape.vertices for shape in shapes])
+    indices = np.concatenate([shape.indices for shape in shapes]) + offsets
 
-def scaleVertices(shape, stride, scaleFactor):
+    return Shape(vertices, indices, strideSize)
 
+
+def _vertexRows(shape, stride):
+    # 2D view of the vertices, one row per vertex, writes go to the shape itself
     numberOfVertices = len(shape.vertices) // stride
+    return shape.vertices[:numberOfVertices * stride].reshape((numberOfVertices, stride))
+
+
+def applyOffset(shape, stride, offset):
 
-    for i in range(numberOfVertices):
-        index = i * stride
-        shape.vertices[index]     *= scaleFactor[0]
-        shape.vertices[index + 1] *= scaleFactor[1]
-        shape.vertices[index + 2] *= scaleFactor[2]
+    _vertexRows(shape, stride)[:, 0:3] += np.asarray(offset, dtype=np.float32)
+
+
+def scaleVertices(shape, stride, scaleFactor):
+
+    _vertexRows(shape, stride)[:, 0:3] *= np.asarray(scaleFactor, dtype=np.float32)
 
 
 def createAxis(length=1.0):
@@ -186,61 +208,208 @@ def createTextureQuadWithDims(nx, ny, height, width):
 
     return Shape(vertices, indices)
 
+def _circleRing(N):
+    # The N vertices of a circle of radius 0.5, and the fan indices used by the circle shapes
+    theta = np.arange(N) * (2 * math.pi / N)
+    ring = np.stack((0.5 * np.cos(theta), 0.5 * np.sin(theta), np.zeros(N)), axis=1)
+
+    # A triangle is created using the center, this and the next vertex,
+    # the final triangle connects back to the second vertex
+    i = np.arange(N)
+    indices = np.concatenate((np.stack((np.zeros(N), i, i + 1), axis=1).reshape(-1), [0, N, 1]))
+
+    return theta, ring, indices
+
+
 def createColorCircle(N, r, g, b):
 
+    theta, ring, indices = _circleRing(N)
+
     # First vertex at the center
     colorOffsetAtCenter = 0.3
-    vertices = [0, 0, 0,
+    center = [0, 0, 0,
         r + colorOffsetAtCenter,
         g + colorOffsetAtCenter,
         b + colorOffsetAtCenter]
-    indices = []
 
-    dtheta = 2 * math.pi / N
+    colors = np.tile([r, g, b], (N, 1))
+    vertices = np.concatenate((center, np.concatenate((ring, colors), axis=1).reshape(-1)))
 
-    for i in range(N):
-        theta = i * dtheta
+    return Shape(vertices, indices, 6)
 
-        vertices += [
-            # vertex coordinates
-            0.5 * math.cos(theta), 0.5 * math.sin(theta), 0,
-            # color
-            r, g, b]
 
-        # A triangle is created using the center, this and the next vertex
-        indices += [0, i, i+1]
+def createRainbowCircle(N):
 
-    # The final triangle connects back to the second vertex
-    indices += [0, N, 1]
+    theta, ring, indices = _circleRing(N)
 
-    return Shape(vertices, indices)
+    # First vertex at the center, white color
+    center = [0, 0, 0, 1.0, 1.0, 1.0]
 
+    # color generates varying between 0 and 1
+    colors = np.stack((np.sin(theta), np.cos(theta), np.zeros(N)), axis=1)
+    vertices = np.concatenate((center, np.concatenate((ring, colors), axis=1).reshape(-1)))
 
-def createRainbowCircle(N):
+    return Shape(vertices, indices, 6)
 
-    # First vertex at the center, white color
-    vertices = [0, 0, 0, 1.0, 1.0, 1.0]
-    indices = []
 
-    dtheta = 2 * math.pi / N
+def _colorNormalShape(positions, normals, triangles, r, g, b):
+    # positions, colors and normals => 9 floats per vertex
+    colors = np.broadcast_to(np.array([r, g, b], dtype=np.float32), (len(positions), 3))
+    vertices = np.concatenate((positions, colors, normals), axis=1)
+    return Shape(vertices, triangles, 9)
 
-    for i in range(N):
-        theta = i * dtheta
 
-        vertices += [
-            # vertex coordinates
-            0.5 * math.cos(theta), 0.5 * math.sin(theta), 0,
+def _gridTriangles(rows, columns):
+    # Two triangles for each cell of a grid of (rows + 1) x (columns + 1) vertices
+    row, column = np.meshgrid(np.arange(rows), np.arange(columns), indexing='ij')
+    a = (row * (columns + 1) + column).reshape(-1)
+    b = a + 1
+    c = a + columns + 1
+    d = c + 1
+    return np.stack((np.stack((a, b, c), axis=1), np.stack((b, d, c), axis=1)), axis=1).reshape((-1, 3))
 
-            # color generates varying between 0 and 1
-                  math.sin(theta),       math.cos(theta), 0]
 
-        # A triangle is created using the center, this and the next vertex
-        indices += [0, i, i+1]
+def _disk(N, z, normalZ):
+    # Center and border of a disk of radius 0.5 facing normalZ, with its fan triangles
+    theta = np.arange(N) * (2 * math.pi / N)
+    positions = np.zeros((N + 1, 3))
+    positions[1:, 0] = 0.5 * np.cos(theta)
+    positions[1:, 1] = 0.5 * np.sin(theta)
+    positions[:, 2] = z
+    normals = np.tile([0.0, 0.0, normalZ], (N + 1, 1))
 
-    # The final triangle connects back to the second vertex
-    indices += [0, N, 1]
+    i = np.arange(N)
+    triangles = np.stack((np.zeros(N, dtype=np.int64), 1 + i, 1 + (i + 1) % N), axis=1)
+    if normalZ < 0:
+        triangles = triangles[:, ::-1]
 
-    return Shape(vertices, indices)
+    return positions, normals, triangles
+
+
+def _joinParts(parts):
+    # Concatenates (positions, normals, triangles) parts into a single indexed mesh
+    offsets = np.cumsum([0] + [len(positions) for positions, _, _ in parts[:-1]])
+    positions = np.concatenate([part[0] for part in parts])
+    normals = np.concatenate([part[1] for part in parts])
+    triangles = np.concatenate([part[2] + offset for part, offset in zip(parts, offsets)])
+    return positions, normals, triangles
+
+
+def createColorNormalDisk(r, g, b, N=32):
+    """Disk of radius 0.5 on the XY plane, facing +Z"""
+    return _colorNormalShape(*_disk(N, 0.0, 1.0), r, g, b)
+
+
+def createColorNormalSphere(r, g, b, slices=32, stacks=16):
+    """UV sphere of radius 0.5 with smooth normals, Z is the polar axis"""
+
+    phi = np.linspace(0, math.pi, stacks + 1)
+    theta = np.linspace(0, 2 * math.pi, slices + 1)
+    phi, theta = np.meshgrid(phi, theta, indexing='ij')
+
+    normals = np.stack((np.sin(phi) * np.cos(theta), np.sin(phi) * np.sin(theta), np.cos(phi)), axis=-1).reshape((-1, 3))
+    triangles = _gridTriangles(stacks, slices).reshape((stacks, slices, 2, 3))
+
+    # At the poles one triangle of each cell collapses into a line
+    triangles = np.concatenate((
+        triangles[0, :, 1],
+        triangles[1:-1].reshape((-1, 3)),
+        triangles[-1, :, 0]))
+
+    # phi grows southwards, the grid winding is reversed to face outwards
+    return _colorNormalShape(0.5 * normals, normals, triangles[:, ::-1], r, g, b)
+
+
+def createColorNormalIcosphere(r, g, b, subdivisions=3):
+    """Sphere of radius 0.5 from a subdivided icosahedron, with evenly sized triangles"""
+
+    t = (1 + math.sqrt(5)) / 2
+    positions = np.array([
+        [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+        [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+        [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1]], dtype=np.float64)
+    positions /= np.linalg.norm(positions, axis=1)[:, None]
+
+    triangles = np.array([
+        [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+        [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+        [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+        [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1]])
+
+    for _ in range(subdivisions):
+        # Every edge gets one new vertex, shared by the two triangles around it
+        edges = np.sort(triangles[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 2)), axis=1)
+        edges, edgeIndex = np.unique(edges, axis=0, return_inverse=True)
+
+        midpoints = positions[edges[:, 0]] + positions[edges[:, 1]]
+        midpoints /= np.linalg.norm(midpoints, axis=1)[:, None]
+
+        m = len(positions) + edgeIndex.reshape((-1, 3))
+        first, second, third = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        triangles = np.stack((
+            np.stack((first, m[:, 0], m[:, 2]), axis=1),
+            np.stack((second, m[:, 1], m[:, 0]), axis=1),
+            np.stack((third, m[:, 2], m[:, 1]), axis=1),
+            m), axis=1).reshape((-1, 3))
+        positions = np.concatenate((positions, midpoints))
+
+    return _colorNormalShape(0.5 * positions, positions, triangles, r, g, b)
+
+
+def createColorNormalCylinder(r, g, b, slices=32):
+    """Cylinder of radius 0.5 and height 1 along Z, centered at the origin, with caps"""
+
+    theta = np.linspace(0, 2 * math.pi, slices + 1)
+    z = np.array([-0.5, 0.5])
+    z, theta = np.meshgrid(z, theta, indexing='ij')
+
+    sideNormals = np.stack((np.cos(theta), np.sin(theta), np.zeros_like(theta)), axis=-1).reshape((-1, 3))
+    sidePositions = 0.5 * sideNormals
+    sidePositions[:, 2] = z.reshape(-1)
+    side = (sidePositions, sideNormals, _gridTriangles(1, slices))
+
+    return _colorNormalShape(*_joinParts([side, _disk(slices, -0.5, -1.0), _disk(slices, 0.5, 1.0)]), r, g, b)
+
+
+def createColorNormalCone(r, g, b, slices=32):
+    """Cone of radius 0.5 and height 1 along Z, base at z = -0.5 and apex at z = 0.5"""
+
+    # The apex is repeated once per slice, with the normal of the middle of that slice
+    theta = np.linspace(0, 2 * math.pi, slices + 1)
+    middle = theta[:-1] + math.pi / slices
+
+    # For radius 0.5 and height 1 the side normal is (cos, sin, 0.5) normalized
+    def slopeNormals(angles):
+        normals = np.stack((np.cos(angles), np.sin(angles), np.full(len(angles), 0.5)), axis=1)
+        return normals / np.linalg.norm(normals[0])
+
+    basePositions = np.stack((0.5 * np.cos(theta), 0.5 * np.sin(theta), np.full(slices + 1, -0.5)), axis=1)
+    apexPositions = np.tile([0.0, 0.0, 0.5], (slices, 1))
+
+    i = np.arange(slices)
+    side = (
+        np.concatenate((basePositions, apexPositions)),
+        np.concatenate((slopeNormals(theta), slopeNormals(middle))),
+        np.stack((i, i + 1, slices + 1 + i), axis=1))
+
+    return _colorNormalShape(*_joinParts([side, _disk(slices, -0.5, -1.0)]), r, g, b)
+
+
+def createColorNormalTorus(r, g, b, majorSegments=48, minorSegments=24, thickness=0.3):
+    """Torus on the XY plane fitting in a unit box, thickness is the diameter of its tube"""
+
+    minorRadius = thickness / 2
+    majorRadius = 0.5 - minorRadius
+
+    u = np.linspace(0, 2 * math.pi, majorSegments + 1)
+    v = np.linspace(0, 2 * math.pi, minorSegments + 1)
+    u, v = np.meshgrid(u, v, indexing='ij')
+
+    normals = np.stack((np.cos(v) * np.cos(u), np.cos(v) * np.sin(u), np.sin(v)), axis=-1).reshape((-1, 3))
+    centers = np.stack((majorRadius * np.cos(u), majorRadius * np.sin(u), np.zeros_like(u)), axis=-1).reshape((-1, 3))
+
+    triangles = _gridTriangles(majorSegments, minorSegments)[:, ::-1]
+    return _colorNormalShape(centers + minorRadius * normals, normals, triangles, r, g, b)
 
 
 def createRainbowCube():
@@ -270,82 +439,14 @@ def createRainbowCube():
 
     return Shape(vertices, indices)
 
-def readOFF(filename, color):
-    vertices = []
-    normals= []
-    faces = []
+def readOFF(filename, color, indexed=False, weighting="area"):
 
-    with open(filename, 'r') as file:
-        line = file.readline().strip()
-        assert line=="OFF"
+    # Parsed geometry is memoized by lib.mesh_loader, only the color is applied per call
+    shape = load_mesh(filename, color, indexed, weighting)
 
-        line = file.readline().strip()
-        aux = line.split(' ')
+    return Shape(shape.vertices, shape.indices, 9)
 
-        numVertices = int(aux[0])
-        numFaces = int(aux[1])
 
-        for i in range(numVertices):
-            aux = file.readline().strip().split(' ')
-            vertices += [float(coord) for coord in aux[0:]]
-        
-        vertices = np.asarray(vertices)
-        vertices = np.reshape(vertices, (numVertices, 3))
-        #print(f'Vertices shape: {vertices.shape}')
-
-        normals = np.zeros((numVertices,3), dtype=np.float32)
-        #print(f'Normals shape: {normals.shape}')
-
-        for i in range(numFaces):
-            aux = file.readline().strip().split(' ')
-            aux = [int(index) for index in aux[0:]]
-            faces += [aux[1:]]
-            
-            vecA = [vertices[aux[2]][0] - vertices[aux[1]][0], vertices[aux[2]][1] - vertices[aux[1]][1], vertices[aux[2]][2] - vertices[aux[1]][2]]
-            vecB = [vertices[aux[3]][0] - vertices[aux[2]][0], vertices[aux[3]][1] - vertices[aux[2]][1], vertices[aux[3]][2] - vertices[aux[2]][2]]
-
-            res = np.cross(vecA, vecB)
-            normals[aux[1]][0] += res[0]  
-            normals[aux[1]][1] += res[1]  
-            normals[aux[1]][2] += res[2]  
-
-            normals[aux[2]][0] += res[0]  
-            normals[aux[2]][1] += res[1]  
-            normals[aux[2]][2] += res[2]  
-
-            normals[aux[3]][0] += res[0]  
-            normals[aux[3]][1] += res[1]  
-            normals[aux[3]][2] += res[2]  
-        #print(faces)
-        norms = np.linalg.norm(normals,axis=1)
-        normals = normals/norms[:,None]
-
-        color = np.asarray(color)
-        color = np.tile(color, (numVertices, 1))
-
-        vertexData = np.concatenate((vertices, color), axis=1)
-        vertexData = np.concatenate((vertexData, normals), axis=1)
-
-        #print(vertexData.shape)
-
-        indices = []
-        vertexDataF = []
-        index = 0
-
-        for face in faces:
-            vertex = vertexData[face[0],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[1],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[2],:]
-            vertexDataF += vertex.tolist()
-            
-            indices += [index, index + 1, index + 2]
-            index += 3        
-
-
-
-        return Shape(vertexDataF, indices)
 
 def createColorCubeTarea2(r,g,b):
 
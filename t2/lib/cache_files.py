@@ -0,0 +1,39 @@
+# coding=utf-8
+"""Crash safe writes of the binary caches stored next to the assets"""
+
+import json
+import os
+import numpy as np
+
+
+def _replace(path, mode, write):
+    # Writing to a temporary file first, so a crash never leaves a half written file
+    temporary = path + ".tmp"
+    with open(temporary, mode) as file:
+        write(file)
+    os.replace(temporary, path)
+
+
+def write_entry(directory, arrays, meta_path, meta, stale=()):
+    """Writes a cache entry: arrays, a list of (path, array) saved as .npy, then meta as JSON.
+
+    The paths in stale are removed first. The metadata is written last, it is
+    what marks the entry as valid. Returns False if the entry could not be
+    written, a read-only assets folder just means running without cache.
+    """
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+
+        for path, array in arrays:
+            _replace(path, 'wb', lambda file: np.save(file, array))
+
+        _replace(meta_path, 'w', lambda file: json.dump(meta, file))
+    except OSError:
+        return False
+
+    return True
@@ -3,11 +3,11 @@
 
 from OpenGL.GL import *
 import OpenGL.GL.shaders
-import numpy as np
 from PIL import Image
 
 import lib.basic_shapes as bs
 from lib.gpu_shape import GPUShape
+from lib.texture_upload import uploadImage
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -17,12 +17,13 @@ __license__ = "MIT"
 SIZE_IN_BYTES = 4
 
 
-def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode):
+def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, immutable=False):
      # wrapMode: GL_REPEAT, GL_CLAMP_TO_EDGE
      # filterMode: GL_LINEAR, GL_NEAREST
+     # immutable: glTexStorage2D allocation, see texture_upload.uploadImage
     texture = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture)
-    
+
     # texture wrapping params
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, sWrapMode)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, tWrapMode)
@@ -30,21 +31,11 @@ def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMo
     # texture filtering params
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minFilterMode)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, maxFilterMode)
-    
-    image = Image.open(imgName)
-    img_data = np.array(image, np.uint8)
-
-    if image.mode == "RGB":
-        internalFormat = GL_RGB
-        format = GL_RGB
-    elif image.mode == "RGBA":
-        internalFormat = GL_RGBA
-        format = GL_RGBA
-    else:
-        print("Image mode not supported.")
-        raise Exception()
-
-    glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, image.size[0], image.size[1], 0, format, GL_UNSIGNED_BYTE, img_data)
+
+    # imgName may also be an already decoded PIL Image, e.g. from an AssetPreloader.
+    # Other modes than RGB, RGBA, L and LA are converted, see texture_upload.uploadableImage
+    image = imgName if isinstance(imgName, Image.Image) else Image.open(imgName)
+    uploadImage(image, immutable)
 
     return texture
 
@@ -112,7 +103,7 @@ class SimpleShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -185,8 +176,9 @@ class SimpleTextureShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
         
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -258,7 +250,7 @@ class SimpleTransformShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
         
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -335,8 +327,9 @@ class SimpleTextureTransformShaderProgram:
         assert isinstance(gpuShape, GPUShape)
 
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -410,7 +403,7 @@ class SimpleModelViewProjectionShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -489,8 +482,17 @@ class SimpleTextureModelViewProjectionShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glBindSampler(0, gpuShape.sampler or 0)
+
+        if gpuShape.submeshes is None:
+            glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
+            glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
+        else:
+            # One range of the shared index buffer per material, e.g. from obj_handler.read_OBJ2_materials
+            for submesh in gpuShape.submeshes:
+                texture = gpuShape.texture if submesh.texture is None else submesh.texture
+                glBindTexture(GL_TEXTURE_2D, texture)
+                glDrawElements(mode, submesh.count, gpuShape.indexType, ctypes.c_void_p(submesh.start * gpuShape.indexSize))
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -569,10 +571,122 @@ class SimpleTextureModelViewProjectionShaderProgram_2:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
+
+
+class TextureArrayInstancedShaderProgram:
+    """
+    Draws many copies of a textured shape in one call. Each instance has its own
+    model matrix and samples its own layer of a GL_TEXTURE_2D_ARRAY,
+    see texture_atlas.InstanceBatch.
+    """
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 330
+            
+            uniform mat4 projection;
+            uniform mat4 view;
+
+            in vec3 position;
+            in vec2 texCoords;
+
+            // Per instance attributes
+            in mat4 model;
+            in float layer;
+
+            out vec3 outTexCoords;
+
+            void main()
+            {
+                gl_Position = projection * view * model * vec4(position, 1.0f);
+                outTexCoords = vec3(texCoords, layer);
+            }
+            """
+
+        fragment_shader = """
+            #version 330
+
+            uniform sampler2DArray samplerTex;
+
+            in vec3 outTexCoords;
+
+            out vec4 outColor;
+
+            void main()
+            {
+                outColor = texture(samplerTex, outTexCoords);
+            }
+            """
+
+        # Binding artificial vertex array object for validation
+        VAO = glGenVertexArrays(1)
+        glBindVertexArray(VAO)
+
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+
+
+    def setupVAO(self, gpuShape):
+
+        glBindVertexArray(gpuShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, gpuShape.ebo)
+
+        # 3d vertices + 2d texture coordinates => 3*4 + 2*4 = 20 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 20, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+        
+        texCoords = glGetAttribLocation(self.shaderProgram, "texCoords")
+        glVertexAttribPointer(texCoords, 2, GL_FLOAT, GL_FALSE, 20, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(texCoords)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def setupInstances(self, gpuShape, instanceVbo):
+        """Per instance attributes, read once per instance from instanceVbo"""
+
+        glBindVertexArray(gpuShape.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, instanceVbo)
+
+        # 4x4 model matrix by columns + layer => 17*4 = 68 bytes
+        model = glGetAttribLocation(self.shaderProgram, "model")
+        for column in range(4):
+            glVertexAttribPointer(model + column, 4, GL_FLOAT, GL_FALSE, 68, ctypes.c_void_p(16 * column))
+            glEnableVertexAttribArray(model + column)
+            glVertexAttribDivisor(model + column, 1)
+
+        layer = glGetAttribLocation(self.shaderProgram, "layer")
+        glVertexAttribPointer(layer, 1, GL_FLOAT, GL_FALSE, 68, ctypes.c_void_p(64))
+        glEnableVertexAttribArray(layer)
+        glVertexAttribDivisor(layer, 1)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, gpuShape, instanceCount, mode=GL_TRIANGLES):
+        assert isinstance(gpuShape, GPUShape)
+
+        # Binding the VAO and executing the draw call
+        glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, gpuShape.texture)
+        glDrawElementsInstanced(mode, gpuShape.size, gpuShape.indexType, None, instanceCount)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
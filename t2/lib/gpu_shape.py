@@ -5,6 +5,8 @@
 from OpenGL.GL import *
 import numpy as np
 
+from lib.vertex_cache import optimizeVertexCache
+
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
@@ -20,7 +22,13 @@ class GPUShape:
         self.vbo = None
         self.ebo = None
         self.texture = None
+        self.textureManager = None
+        self.sampler = None
         self.size = None
+        self.submeshes = None
+        self.indexType = GL_UNSIGNED_INT
+        self.indexSize = 4
+        self.vertexFormat = None
 
     def initBuffers(self):
         """Convenience function for initialization of OpenGL buffers.
@@ -43,22 +51,57 @@ class GPUShape:
 
     def fillBuffers(self, vertices, indices, usage):
 
-        vertexData = np.array(vertices, dtype=np.float32)
-        indices = np.array(indices, dtype=np.uint32)
+        # A vertex format, if any, decides how each attribute is stored
+        if self.vertexFormat is None:
+            vertexData = np.array(vertices, dtype=np.float32)
+        else:
+            vertexData = self.vertexFormat.pack(vertices)
+
+        indices = np.asarray(indices)
+
+        # The smallest index type able to address every vertex, drawCall passes it to glDrawElements
+        if len(indices) == 0 or indices.max() < 2**16:
+            self.indexType, self.indexSize = GL_UNSIGNED_SHORT, 2
+            indices = np.array(indices, dtype=np.uint16)
+        else:
+            self.indexType, self.indexSize = GL_UNSIGNED_INT, 4
+            indices = np.array(indices, dtype=np.uint32)
 
         self.size = len(indices)
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, len(vertexData) * SIZE_IN_BYTES, vertexData, usage)
+        glBufferData(GL_ARRAY_BUFFER, vertexData.nbytes, vertexData, usage)
 
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, len(indices) * SIZE_IN_BYTES, indices, usage)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, usage)
+
+    def releaseTexture(self):
+        """Deletes the texture, or gives it back to the texture manager it was acquired from"""
+
+        if self.texture != None:
+            if self.textureManager != None:
+                self.textureManager.release(self.texture)
+            else:
+                glDeleteTextures(1, [self.texture])
+
+        self.texture = None
+        self.textureManager = None
+        self.sampler = None
+
+    def releaseSubmeshTextures(self):
+        """Gives the submesh textures back to the texture manager they were acquired from"""
+
+        for submesh in self.submeshes or []:
+            if submesh.texture != None and submesh.textureManager != None:
+                submesh.textureManager.release(submesh.texture)
+                submesh.texture = None
+                submesh.textureManager = None
 
     def clear(self):
         """Freeing GPU memory"""
 
-        if self.texture != None:
-            glDeleteTextures(1, [self.texture])
+        self.releaseTexture()
+        self.releaseSubmeshTextures()
         
         if self.ebo != None:
             glDeleteBuffers(1, [self.ebo])
@@ -70,14 +113,120 @@ class GPUShape:
             glDeleteVertexArrays(1, [self.vao])
 
 
-def createGPUShape(pipeline, shape):
+def createGPUShape(pipeline, shape, optimize=False, stride=None, vertexFormat=None, submeshes=None, report=False):
     """Shortcut for the typical way to create a GPUShape.
     Please consider that GL_STATIC_DRAW is not always the best way to draw.
     You should also know what setupVAO and fillBuffers do in a low level,
     in case you want to implement something new, like two textures,
     bump mapping, alternative ways to represent of vertices, etc.
+
+    optimize: reorder an indexed triangle shape for the vertex cache before
+    uploading it, see vertex_cache.optimizeVertexCache. The vertex stride is
+    deduced from the highest index unless it is given. report prints the
+    ACMR before and after.
+
+    submeshes: index ranges drawn one per material, e.g. from
+    obj_handler.read_OBJ2_materials, they are kept valid when optimizing.
+    TextureManager.assignSubmeshes binds their map_Kd textures.
+
+    vertexFormat: a vertex_format.VertexFormat to store the vertices with,
+    e.g. compact types. Its attribute pointers replace pipeline.setupVAO.
     """
+    if vertexFormat is not None and stride is None:
+        stride = vertexFormat.floatsPerVertex
+
+    if optimize:
+        if stride is None:
+            vertexCount = int(np.max(shape.indices)) + 1
+            assert len(shape.vertices) % vertexCount == 0, "The vertex stride can not be deduced, please provide it."
+            stride = len(shape.vertices) // vertexCount
+        shape = optimizeVertexCache(shape, stride, submeshes=submeshes, report=report)
+
     gpuShape = GPUShape().initBuffers()
-    pipeline.setupVAO(gpuShape)
+    gpuShape.vertexFormat = vertexFormat
+    if vertexFormat is None:
+        pipeline.setupVAO(gpuShape)
+    else:
+        vertexFormat.setupVAO(pipeline.shaderProgram, gpuShape)
     gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
+    gpuShape.submeshes = submeshes
     return gpuShape
+
+
+class MeshInstance(GPUShape):
+    """
+    A GPUShape drawing geometry shared through a GeometryRegistry.
+    Buffers belong to the registry, only the texture belongs to the instance,
+    so it can be used anywhere a GPUShape is expected.
+    """
+
+    def __init__(self, registry, key, geometry):
+        super().__init__()
+        self.registry = registry
+        self.key = key
+
+        self.vao = geometry.vao
+        self.vbo = geometry.vbo
+        self.ebo = geometry.ebo
+        self.size = geometry.size
+        self.submeshes = geometry.submeshes
+        self.indexType = geometry.indexType
+        self.indexSize = geometry.indexSize
+        self.vertexFormat = geometry.vertexFormat
+
+    def initBuffers(self):
+        raise RuntimeError("The buffers of a MeshInstance belong to its GeometryRegistry.")
+
+    def fillBuffers(self, vertices, indices, usage):
+        raise RuntimeError("The buffers of a MeshInstance are shared, they can not be refilled.")
+
+    def clear(self):
+        """Freeing the texture and releasing the shared buffers"""
+
+        self.releaseTexture()
+        self.releaseSubmeshTextures()
+
+        if self.key != None:
+            self.registry.release(self.key)
+            self.key = None
+
+        self.vao = self.vbo = self.ebo = None
+
+
+class GeometryRegistry:
+    """
+    Uploads each generated shape once and shares its buffers.
+    Geometry is identified by the generator, its parameters and the vertex
+    layout, given by the shader program and vertex format the VAO is set up for.
+    Buffers are reference counted and freed when the last instance is cleared.
+    """
+
+    def __init__(self):
+        self.geometries = {}
+        self.references = {}
+
+    def instance(self, pipeline, generator, *args, optimize=False, vertexFormat=None, **kwargs):
+        """MeshInstance of generator(*args, **kwargs), uploading it on first use"""
+
+        key = (generator, args, tuple(sorted(kwargs.items())), pipeline.shaderProgram, optimize,
+            None if vertexFormat is None else (tuple(vertexFormat.layout), vertexFormat.compact, vertexFormat.packedNormals))
+
+        if key not in self.geometries:
+            shape = generator(*args, **kwargs)
+            self.geometries[key] = createGPUShape(pipeline, shape, optimize=optimize, vertexFormat=vertexFormat)
+            self.references[key] = 0
+
+        self.references[key] += 1
+        return MeshInstance(self, key, self.geometries[key])
+
+    def release(self, key):
+        self.references[key] -= 1
+        if self.references[key] == 0:
+            self.geometries.pop(key).clear()
+            del self.references[key]
+
+    def report(self):
+        """Prints the shared geometries and how many instances use each one"""
+        for key, geometry in self.geometries.items():
+            generator, args = key[0], key[1]
+            print(f"{generator.__name__}{args}: {self.references[key]} instances, vao={geometry.vao}")
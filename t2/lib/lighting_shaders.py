@@ -123,7 +123,7 @@ class SimpleFlatShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -249,9 +249,10 @@ class SimpleTextureFlatShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -370,7 +371,7 @@ class SimpleGouraudShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -496,9 +497,10 @@ class SimpleTextureGouraudShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -623,7 +625,7 @@ class SimplePhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -752,9 +754,10 @@ class SimpleTexturePhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -809,9 +812,10 @@ class MultipleLightTexturePhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
+        glBindSampler(0, gpuShape.sampler or 0)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -866,7 +870,7 @@ class MultipleLightPhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
\ No newline at end of file
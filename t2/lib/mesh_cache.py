@@ -0,0 +1,95 @@
+# coding=utf-8
+"""Binary cache for the meshes read by the obj_handler loaders"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sys
+import numpy as np
+
+from lib.cache_files import write_entry
+from lib.shapes import Shape as _Shape
+
+# Cached meshes are stored next to their source file, inside this folder
+CACHE_DIRECTORY = ".mesh_cache"
+
+# Bumped whenever the layout of the cached files changes
+CACHE_VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _module_hash(module_name):
+    """Hash of a loader module source, so fixing a loader invalidates what it cached"""
+    try:
+        with open(inspect.getsourcefile(sys.modules[module_name]), 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()[:16]
+    except (KeyError, TypeError, OSError):
+        return ""
+
+
+def _cache_paths(filename, loader, args, kwargs):
+    """Sidecar paths for a given source file and loader variant"""
+
+    variant = (f"v{CACHE_VERSION}:{_module_hash(loader.__module__)}:"
+        f"{loader.__module__}.{loader.__qualname__}{args!r}{sorted(kwargs.items())!r}")
+    digest = hashlib.sha1((os.path.abspath(filename) + variant).encode('utf-8')).hexdigest()[:16]
+
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRECTORY)
+    base = os.path.join(directory, os.path.basename(filename) + "." + digest)
+
+    return directory, base + ".vertices.npy", base + ".indices.npy", base + ".json"
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _read_cache(filename, vertices_path, indices_path, meta_path):
+    """Returns the cached shape, or None when it is missing or stale"""
+
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if meta != _source_stamp(filename):
+        return None
+
+    try:
+        vertices = np.load(vertices_path, mmap_mode='r')
+        indices = np.load(indices_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+    return _Shape(vertices, indices)
+
+
+def load_cached(loader, filename, *args, **kwargs):
+    """Loads a mesh through loader(filename, *args, **kwargs), reusing a binary cache.
+
+    The final float32 vertices and uint32 indices are stored in .npy files
+    keyed by the source path, the loader variant and the source code of the
+    loader module. Warm starts memory map them instead of parsing the text
+    file again. An entry is rebuilt whenever the modification time or size
+    of the source file changes, or the loader module is edited.
+    """
+
+    directory, vertices_path, indices_path, meta_path = _cache_paths(filename, loader, args, kwargs)
+
+    shape = _read_cache(filename, vertices_path, indices_path, meta_path)
+    if shape is not None:
+        return shape
+
+    stamp = _source_stamp(filename)
+    shape = loader(filename, *args, **kwargs)
+    vertices = np.asarray(shape.vertices, dtype=np.float32)
+    indices = np.asarray(shape.indices, dtype=np.uint32)
+
+    # The stamp of an older entry is removed, it would validate half replaced arrays
+    write_entry(directory, [(vertices_path, vertices), (indices_path, indices)], meta_path, stamp, stale=[meta_path])
+
+    return _Shape(vertices, indices)
@@ -0,0 +1,67 @@
+# coding=utf-8
+"""Single entry point to load meshes from disk, with memoized geometry"""
+
+import os
+from functools import lru_cache
+
+from lib.shapes import Shape as _Shape
+import lib.obj_handler as _obj
+
+# How many parsed meshes (per path and parameters) are kept in memory
+MESH_CACHE_SIZE = 32
+
+
+@lru_cache(maxsize=MESH_CACHE_SIZE)
+def _load_geometry(filename, stamp, kind, indexed, weighting):
+    """Parses a mesh once per path, modification time and parameters.
+
+    Colored layouts are parsed with a black placeholder color, the real one
+    is written afterwards by load_mesh.
+    """
+
+    if kind == "off":
+        shape = _obj.readOFF(filename, (0.0, 0.0, 0.0), indexed, weighting)
+    elif kind == "obj_color":
+        shape = _obj.read_OBJ(filename, (0.0, 0.0, 0.0), indexed)
+    else:
+        shape = _obj.read_OBJ2(filename, indexed)
+
+    # Cached arrays are shared among calls, they must never be modified
+    shape.vertices.flags.writeable = False
+    shape.indices.flags.writeable = False
+    return shape
+
+
+def load_mesh(filename, color=None, indexed=False, weighting="area"):
+    """Loads a mesh choosing the reader by file extension.
+
+    .off files need a color and produce position, color and normal vertices.
+    .obj files produce position, color and normal vertices if a color is
+    given, otherwise position, texture coordinates and normal vertices.
+    weighting selects how .off smooth normals are computed, "area" or "angle".
+    """
+
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension == ".off":
+        assert color is not None, "A color is required to load .off files."
+        kind = "off"
+    elif extension == ".obj":
+        kind = "obj2" if color is None else "obj_color"
+        weighting = None
+    else:
+        raise ValueError(f"Unsupported mesh format: {extension}")
+
+    stamp = os.stat(filename).st_mtime_ns
+    shape = _load_geometry(os.path.abspath(filename), stamp, kind, indexed, weighting)
+
+    vertices = shape.vertices.copy()
+    if color is not None:
+        # position, color, normal => the color lives in columns 3 to 5
+        vertices.reshape((-1, 9))[:, 3:6] = color
+
+    return _Shape(vertices, shape.indices.copy())
+
+
+def clear_mesh_cache():
+    _load_geometry.cache_clear()
@@ -0,0 +1,180 @@
+# coding=utf-8
+"""Quadric error edge collapse simplification and level of detail chains"""
+
+import heapq
+import numpy as np
+
+from lib.shapes import Shape as _Shape
+
+# A collapse is rejected if it turns a triangle normal more than this (cosine)
+MIN_NORMAL_COSINE = 0.2
+
+
+def _weld(positions):
+    """Ids grouping the vertices that share a position, so attribute seams do not open cracks"""
+
+    _, first, weld_id = np.unique(positions, axis=0, return_index=True, return_inverse=True)
+    return positions[first], weld_id.reshape(-1)
+
+
+def _quadrics(positions, triangles):
+    """Area weighted sum of the plane quadrics of the triangles around each vertex"""
+
+    corners = positions[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    normals = normals / np.where(areas == 0, 1, areas)[:, None]
+
+    planes = np.concatenate((normals, -np.einsum('ij,ij->i', normals, corners[:, 0])[:, None]), axis=1)
+    face_quadrics = areas[:, None, None] * planes[:, :, None] * planes[:, None, :]
+
+    quadrics = np.zeros((len(positions), 4, 4))
+    for i in range(3):
+        np.add.at(quadrics, triangles[:, i], face_quadrics)
+
+    return quadrics
+
+
+def _cost(quadric, position):
+    v = np.append(position, 1.0)
+    return float(v @ quadric @ v)
+
+
+def _collapse_positions(positions, triangles, target):
+    """Greedy half edge collapses until at most target triangles are left.
+
+    Returns, for every vertex, the vertex it was collapsed into (itself if
+    it survived) and a mask of the triangles that are still valid.
+    """
+
+    quadrics = _quadrics(positions, triangles)
+    parent = np.arange(len(positions))
+    alive = np.ones(len(triangles), dtype=bool)
+    version = np.zeros(len(positions), dtype=np.int64)
+
+    vertex_triangles = [set() for _ in range(len(positions))]
+    for t, triangle in enumerate(triangles.tolist()):
+        for v in triangle:
+            vertex_triangles[v].add(t)
+
+    triangles = triangles.copy()
+    heap = []
+
+    def push(a, b):
+        # Cheapest direction of the collapse, moving a onto b or b onto a
+        quadric = quadrics[a] + quadrics[b]
+        costAB = _cost(quadric, positions[b])
+        costBA = _cost(quadric, positions[a])
+        if costAB <= costBA:
+            heapq.heappush(heap, (costAB, a, b, version[a], version[b]))
+        else:
+            heapq.heappush(heap, (costBA, b, a, version[b], version[a]))
+
+    edges = np.unique(np.sort(np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]])), axis=1), axis=0)
+    for a, b in edges.tolist():
+        push(a, b)
+
+    remaining = len(triangles)
+    while remaining > target and heap:
+        _, a, b, versionA, versionB = heapq.heappop(heap)
+
+        # Entries pushed before a vertex changed are stale
+        if parent[a] != a or parent[b] != b or version[a] != versionA or version[b] != versionB:
+            continue
+
+        shared = vertex_triangles[a] & vertex_triangles[b]
+        moved = vertex_triangles[a] - shared
+
+        if not shared or _flips(positions, triangles, moved, a, positions[b]):
+            continue
+
+        for t in shared:
+            alive[t] = False
+            for v in triangles[t]:
+                vertex_triangles[v].discard(t)
+        remaining -= len(shared)
+
+        for t in moved:
+            triangles[t][triangles[t] == a] = b
+            vertex_triangles[b].add(t)
+        vertex_triangles[a] = set()
+
+        parent[a] = b
+        quadrics[b] += quadrics[a]
+        version[b] += 1
+
+        neighbours = set(triangles[list(vertex_triangles[b])].reshape(-1).tolist()) - {b}
+        for n in neighbours:
+            push(b, n)
+
+    # Resolving chains of collapses to the final surviving vertex
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+
+    return parent, alive
+
+
+def _flips(positions, triangles, moved, a, target):
+    """Whether moving vertex a to target turns any of the moved triangles over"""
+
+    for t in moved:
+        corners = positions[triangles[t]]
+        before = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+
+        corners = corners.copy()
+        corners[triangles[t] == a] = target
+        after = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+
+        lengths = np.linalg.norm(before) * np.linalg.norm(after)
+        if lengths == 0 or np.dot(before, after) < MIN_NORMAL_COSINE * lengths:
+            return True
+
+    return False
+
+
+def simplify(shape, stride, ratio):
+    """Simplifies an indexed triangle shape to about ratio times its triangles.
+
+    Vertices must start with their 3d position, every other attribute
+    (colors, texture coordinates, normals) is kept from the original
+    corner, only positions move. Vertices sharing a position are
+    simplified together, so texture and normal seams stay closed.
+    """
+
+    vertex_data = np.asarray(shape.vertices, dtype=np.float32).reshape((-1, stride))
+    indices = np.asarray(shape.indices, dtype=np.int64).reshape((-1, 3))
+
+    positions, weld_id = _weld(vertex_data[:, 0:3].astype(np.float64))
+    target = max(1, int(len(indices) * ratio))
+
+    collapsed_to, alive = _collapse_positions(positions, weld_id[indices], target)
+
+    # Each surviving corner keeps its attributes and takes the position it collapsed into
+    corners = indices[alive].reshape(-1)
+    corner_data = vertex_data[corners].copy()
+    corner_data[:, 0:3] = positions[collapsed_to[weld_id[corners]]]
+
+    # Merging identical corners back into an indexed mesh
+    unique_data, new_indices = np.unique(corner_data, axis=0, return_inverse=True)
+
+    return _Shape(unique_data.reshape(-1), new_indices.reshape(-1).astype(np.uint32))
+
+
+def generateLODs(shape, stride, ratios=(0.5, 0.25, 0.125)):
+    """Chain of simplified shapes, starting with the original one.
+
+    Every level is simplified from the previous one, ratios are relative
+    to the original triangle count.
+    """
+
+    levels = [shape]
+    triangles = len(shape.indices) // 3
+    for ratio in ratios:
+        previous = levels[-1]
+        previousTriangles = len(previous.indices) // 3
+        levels += [simplify(previous, stride, ratio * triangles / previousTriangles)]
+
+    return levels
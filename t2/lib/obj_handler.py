@@ -1,207 +1,377 @@
+import os
 from lib.shapes import Shape as _Shape
 import numpy as np
 
+from lib.off_handler import off_vertex_data
 
-def read_face_vertex(face_description):
 
-    aux = face_description.split('/')
+def readOFF(filename, color, indexed=False, weighting="area"):
 
-    assert len(aux[0]), "Vertex index has not been defined."
+    vertex_data, faces = off_vertex_data(filename, color, weighting)
 
-    face_vertex = [int(aux[0]), None, None]
+    # Each OFF vertex already carries a single normal, so faces can index it directly
+    if indexed:
+        indices = faces.reshape(-1).astype(np.uint32)
+    else:
+        vertex_data = vertex_data[faces.reshape(-1)]
+        indices = np.arange(len(vertex_data), dtype=np.uint32)
 
-    assert len(aux) == 3, "Only faces where its vertices require 3 indices are defined."
+    return _Shape(vertex_data.astype(np.float32).reshape(-1), indices)
 
-    if len(aux[1]) != 0:
-        face_vertex[1] = int(aux[1])
 
-    if len(aux[2]) != 0:
-        face_vertex[2] = int(aux[2])
+def _parse_OBJ(filename, materials=False):
+    """Parses an .obj file into numpy arrays in bulk.
 
-    return face_vertex
+    Returns the vertex positions, texture coordinates and normals as float
+    arrays, and an (N, 3) int array with the 1-based (vertex, texture, normal)
+    indices of every triangle corner, 3 consecutive rows per triangle.
+    A missing texture or normal index is stored as 0.
 
-def readOFF(filename, color):
-    vertices = []
-    normals= []
-    faces = []
+    With materials, also returns the usemtl material id of every triangle,
+    the material names by id (None for faces before any usemtl) and the
+    mtllib file names.
+    """
 
     with open(filename, 'r') as file:
-        line = file.readline().strip()
-        assert line=="OFF"
-
-        line = file.readline().strip()
-        aux = line.split(' ')
-
-        numVertices = int(aux[0])
-        numFaces = int(aux[1])
-
-        for i in range(numVertices):
-            aux = file.readline().strip().split(' ')
-            vertices += [float(coord) for coord in aux[0:]]
-        
-        vertices = np.asarray(vertices)
-        vertices = np.reshape(vertices, (numVertices, 3))
-        #print(f'Vertices shape: {vertices.shape}')
-
-        normals = np.zeros((numVertices,3), dtype=np.float32)
-        #print(f'Normals shape: {normals.shape}')
-
-        for i in range(numFaces):
-            aux = file.readline().strip().split(' ')
-            aux = [int(index) for index in aux[0:]]
-            faces += [aux[1:]]
-            
-            vecA = [vertices[aux[2]][0] - vertices[aux[1]][0], 
-                    vertices[aux[2]][1] - vertices[aux[1]][1], 
-                    vertices[aux[2]][2] - vertices[aux[1]][2]]
-            vecB = [vertices[aux[3]][0] - vertices[aux[2]][0], 
-                    vertices[aux[3]][1] - vertices[aux[2]][1], 
-                    vertices[aux[3]][2] - vertices[aux[2]][2]]
-
-            res = np.cross(vecA, vecB)
-            
-            normals[aux[1]][0] += res[0]  
-            normals[aux[1]][1] += res[1]  
-            normals[aux[1]][2] += res[2]  
-
-            normals[aux[2]][0] += res[0]  
-            normals[aux[2]][1] += res[1]  
-            normals[aux[2]][2] += res[2]  
-
-            normals[aux[3]][0] += res[0]  
-            normals[aux[3]][1] += res[1]  
-            normals[aux[3]][2] += res[2]  
-            #print(normals)
-        #print(faces)
-        norms = np.linalg.norm(normals,axis=1)
-        normals = normals/norms[:,None]
-
-        color = np.asarray(color)
-        color = np.tile(color, (numVertices, 1))
-
-        vertexData = np.concatenate((vertices, color), axis=1)
-        vertexData = np.concatenate((vertexData, normals), axis=1)
-
-        #print(vertexData.shape)
-
-        indices = []
-        vertexDataF = []
-        index = 0
-
-        for face in faces:
-            vertex = vertexData[face[0],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[1],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[2],:]
-            vertexDataF += vertex.tolist()
-            
-            indices += [index, index + 1, index + 2]
-            index += 3        
-
-
-        return Shape(vertexDataF, indices)
-
-def read_OBJ(filename, color):
-
-    vertices = []
-    normals = []
-    tex_coords = []
-    faces = []
+        lines = file.read().splitlines()
+
+    vertices = _parse_block([line[2:] for line in lines if line.startswith('v ')], 3)
+    normals = _parse_block([line[3:] for line in lines if line.startswith('vn ')], 3)
+    tex_coords = _parse_block([line[3:] for line in lines if line.startswith('vt ')], 2)
+
+    face_positions = [i for i, line in enumerate(lines) if line.startswith('f ')]
+    face_lines = [lines[i][2:] for i in face_positions]
+    corners = _triangulate(face_lines)
+
+    if not materials:
+        return vertices, tex_coords, normals, corners
+
+    libraries = [line[7:].strip() for line in lines if line.startswith('mtllib ')]
+
+    # Material ids by order of first use, 0 is reserved for faces without material
+    names = [None]
+    usemtl_positions = []
+    usemtl_ids = []
+    for i, line in enumerate(lines):
+        if line.startswith('usemtl '):
+            name = line[7:].strip()
+            if name not in names:
+                names += [name]
+            usemtl_positions += [i]
+            usemtl_ids += [names.index(name)]
+
+    # Each face takes the last usemtl written before it
+    last_usemtl = np.searchsorted(usemtl_positions, face_positions, side='right') - 1
+    face_material = np.where(last_usemtl >= 0, np.asarray(usemtl_ids + [0], dtype=np.int64)[last_usemtl], 0)
+    triangle_material = np.repeat(face_material, _corner_count(face_lines) - 2)
+
+    return vertices, tex_coords, normals, corners, triangle_material, names, libraries
+
+
+def _parse_block(lines, dimension):
+    """Parses all the rows of a v/vt/vn block at once"""
+
+    data = np.fromstring(' '.join(lines), dtype=np.float64, sep=' ')
+
+    if len(data) == len(lines) * dimension:
+        return data.reshape((len(lines), dimension))
+
+    # Some rows carry extra values (v x y z w, v x y z r g b, vt u v w), only the first ones are used
+    rows = [line.split()[:dimension] for line in lines]
+    assert all(len(row) == dimension for row in rows), \
+        f"Elements of this block need at least {dimension} coordinates."
+
+    return np.array(rows, dtype=np.float64).reshape((len(lines), dimension))
+
+
+def _corner_count(face_lines):
+    """Number of vertices of each face"""
+
+    # Each face vertex is written as v/t/n, so it contributes exactly two slashes
+    return np.fromiter((line.count('/') for line in face_lines), dtype=np.int64, count=len(face_lines)) // 2
+
+
+def _triangulate(face_lines):
+    """Fan triangulates every face, returning the index triplets of each triangle corner"""
+
+    corner_count = _corner_count(face_lines)
+    assert np.all(corner_count >= 3), "Faces must have at least 3 vertices."
+
+    text = ' '.join(face_lines).replace('//', '/0/').replace('/', ' ')
+    face_vertices = np.fromstring(text, dtype=np.int64, sep=' ')
+
+    assert len(face_vertices) == 3 * corner_count.sum(), "Only faces where its vertices require 3 indices are defined."
+    assert np.all(face_vertices[0::3] > 0), "Vertex index has not been defined."
+
+    face_vertices = face_vertices.reshape((-1, 3))
+
+    # A face with n vertices becomes the fan (0, 1, 2), (2, 3, 0), (3, 4, 0), ..., (n-2, n-1, 0)
+    triangle_count = corner_count - 2
+    first_corner = np.repeat(np.cumsum(corner_count) - corner_count, triangle_count)
+    fan_step = np.arange(triangle_count.sum()) - np.repeat(np.cumsum(triangle_count) - triangle_count, triangle_count)
+
+    triangles = np.stack((first_corner + fan_step + 1, first_corner + fan_step + 2, first_corner), axis=1)
+    first = fan_step == 0
+    triangles[first] = np.stack((first_corner[first], first_corner[first] + 1, first_corner[first] + 2), axis=1)
+
+    return face_vertices[triangles.reshape(-1)]
+
+
+def _index_corners(corners):
+    """Finds the unique (vertex, texture, normal) triplets among the triangle corners.
+
+    Returns the unique triplets, in the order they are first used, and the
+    indices that rebuild every triangle from them.
+    """
+
+    # Rows are compared as a whole, packing them into one integer overflows for large meshes
+    _, first, inverse = np.unique(corners, axis=0, return_index=True, return_inverse=True)
+
+    # np.unique sorts its output, first use order keeps nearby triangles on nearby vertices
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return corners[first[order]], rank[inverse.reshape(-1)].astype(np.uint32)
+
+
+def read_OBJ(filename, color, indexed=False):
+
+    vertices, _, normals, corners = _parse_OBJ(filename)
+
+    if indexed:
+        # Color is the same for every vertex, so only position and normal tell them apart
+        corners[:, 1] = 0
+        corners, indices = _index_corners(corners)
+    else:
+        # Connecting each 3 vertices to create a triangle
+        indices = np.arange(len(corners), dtype=np.uint32)
+
+    colors = np.tile(np.asarray(color, dtype=np.float64), (len(corners), 1))
+
+    vertex_data = np.concatenate((
+        vertices[corners[:, 0] - 1],
+        colors,
+        normals[corners[:, 2] - 1]), axis=1)
+
+    return _Shape(vertex_data.astype(np.float32).reshape(-1), indices)
+
+
+def read_OBJ2(filename, indexed=False):
+
+    vertices, tex_coords, normals, corners = _parse_OBJ(filename)
+
+    return _textured_shape(vertices, tex_coords, normals, corners, indexed)
+
+
+def _textured_shape(vertices, tex_coords, normals, corners, indexed):
+    """Builds the position, texture coordinates and normal layout from the triangle corners"""
+
+    assert np.all(corners[:, 1] > 0), "Texture coordinates have not been defined."
+
+    if indexed:
+        corners, indices = _index_corners(corners)
+    else:
+        # Connecting each 3 vertices to create a triangle
+        indices = np.arange(len(corners), dtype=np.uint32)
+
+    vertex_data = np.concatenate((
+        vertices[corners[:, 0] - 1],
+        tex_coords[corners[:, 1] - 1],
+        normals[corners[:, 2] - 1]), axis=1)
+
+    return _Shape(vertex_data.astype(np.float32).reshape(-1), indices)
+
+
+class Submesh:
+    """Range of the index buffer drawn with a single material.
+
+    start and count are measured in indices. texture is an optional GL
+    texture handle to bind for this range, None keeps the texture of the
+    GPUShape. TextureManager.assignSubmeshes sets it from the map_Kd of
+    the material.
+    """
+
+    def __init__(self, name, material, start, count):
+        self.name = name
+        self.material = material
+        self.start = start
+        self.count = count
+        self.texture = None
+        self.textureManager = None
+
+    def __str__(self):
+        return f"{self.name}: start={self.start} count={self.count}"
+
+
+def read_MTL(filename):
+    """Reads a .mtl file into a dictionary from material name to its properties.
+
+    Numeric properties (Kd, Ka, Ks, Ns, d, ...) are stored as floats or
+    float arrays, texture maps (map_Kd, ...) as paths relative to the file.
+    """
+
+    materials = {}
+    material = None
+    directory = os.path.dirname(filename)
 
     with open(filename, 'r') as file:
-        for line in file.readlines():
-            aux = line.strip().split(' ')
+        for line in file.read().splitlines():
+            aux = line.strip().split(maxsplit=1)
+
+            if len(aux) < 2 or aux[0].startswith('#'):
+                continue
 
-            if aux[0] == 'v':
-                vertices += [[float(coord) for coord in aux[1:]]]
+            if aux[0] == 'newmtl':
+                material = materials[aux[1]] = {}
 
-            elif aux[0] == 'vn':
-                normals += [[float(coord) for coord in aux[1:]]]
+            elif material is not None:
+                if aux[0].startswith('map_'):
+                    material[aux[0]] = os.path.join(directory, aux[1])
+                else:
+                    try:
+                        values = np.array(aux[1].split(), dtype=np.float64)
+                        material[aux[0]] = values[0] if len(values) == 1 else values
+                    except ValueError:
+                        material[aux[0]] = aux[1]
 
-            elif aux[0] == 'vt':
-                assert len(aux[1:]) == 2, "Texture coordinates with different than 2 dimensions are not supported"
-                tex_coords += [[float(coord) for coord in aux[1:]]]
+    return materials
 
-            elif aux[0] == 'f':
-                N = len(aux)
-                faces += [[read_face_vertex(face_vertex) for face_vertex in aux[1:4]]]
-                for i in range(3, N-1):
-                    faces += [[read_face_vertex(face_vertex) for face_vertex in [aux[i], aux[i+1], aux[1]]]]
 
-        vertex_data = []
-        indices = []
-        index = 0
+def read_OBJ2_materials(filename, indexed=False):
+    """Same layout as read_OBJ2, with triangles grouped by their usemtl material.
 
-        # Per previous construction, each face is a triangle
-        for face in faces:
+    Returns the shape and a list of Submesh, one contiguous index range per
+    material in order of first use. Faces before any usemtl get a None material.
+    """
 
-            # Checking each of the triangle vertices
-            for i in range(0, 3):
-                vertex = vertices[face[i][0]-1]
-                normal = normals[face[i][2]-1]
+    vertices, tex_coords, normals, corners, triangle_material, names, libraries = \
+        _parse_OBJ(filename, materials=True)
 
-                vertex_data += [
-                    vertex[0], vertex[1], vertex[2],
-                    color[0], color[1], color[2],
-                    normal[0], normal[1], normal[2]
-                ]
+    materials = {}
+    for library in libraries:
+        path = os.path.join(os.path.dirname(filename), library)
+        if os.path.exists(path):
+            materials.update(read_MTL(path))
 
-            # Connecting the 3 vertices to create a triangle
-            indices += [index, index + 1, index + 2]
-            index += 3
+    # A stable sort keeps the file order inside each material
+    order = np.argsort(triangle_material, kind='stable')
+    corners = corners.reshape((-1, 3, 3))[order].reshape((-1, 3))
 
-    return _Shape(vertex_data, indices)
+    shape = _textured_shape(vertices, tex_coords, normals, corners, indexed)
 
+    submeshes = []
+    start = 0
+    for material_id, triangles in enumerate(np.bincount(triangle_material, minlength=len(names))):
+        if triangles == 0:
+            continue
+        name = names[material_id]
+        submeshes += [Submesh(name, materials.get(name), start, 3 * int(triangles))]
+        start += 3 * int(triangles)
 
-def read_OBJ2(filename):
+    return shape, submeshes
 
-    vertices = []
-    normals = []
-    tex_coords = []
-    faces = []
+
+class GrowableArray:
+    """Row buffer backed by a numpy array that doubles its capacity when full.
+
+    If an array is given, rows are written straight into it and
+    running out of space is an error instead.
+    """
+
+    def __init__(self, columns, dtype=np.float32, capacity=1024, out=None):
+        if out is not None:
+            assert out.ndim == 2 and out.shape[1] == columns, "The given buffer must have one row per element."
+            self.data = out
+            self.growable = False
+        else:
+            self.data = np.empty((capacity, columns), dtype=dtype)
+            self.growable = True
+
+        self.size = 0
+
+    def append(self, rows):
+        required = self.size + len(rows)
+
+        if required > len(self.data):
+            if not self.growable:
+                raise ValueError(f"The given buffer has room for {len(self.data)} rows, {required} are needed.")
+
+            capacity = max(required, 2 * len(self.data))
+            data = np.empty((capacity, self.data.shape[1]), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+        self.data[self.size:required] = rows
+        self.size = required
+
+    def view(self):
+        return self.data[:self.size]
+
+
+def _read_lines(filename, chunk_size):
+    """Yields the lines of a file in lists of about chunk_size characters"""
 
     with open(filename, 'r') as file:
-        for line in file.readlines():
-            aux = line.strip().split(' ')
+        remainder = ''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+
+            lines = (remainder + chunk).split('\n')
+
+            # The last line may continue in the next chunk
+            remainder = lines.pop()
+            yield lines
+
+        if remainder:
+            yield [remainder]
+
+
+def iter_OBJ2(filename, chunk_size=1 << 22):
+    """Reads an .obj file in chunks, yielding float32 (3N, 8) triangle batches.
+
+    Each row is a vertex with position, texture coordinates and normal,
+    every 3 consecutive rows are a triangle, same as read_OBJ2. Only the
+    v/vt/vn tables are kept in memory, faces are expanded and released
+    chunk by chunk.
+    """
+
+    vertices = GrowableArray(3, np.float64)
+    tex_coords = GrowableArray(2, np.float64)
+    normals = GrowableArray(3, np.float64)
+
+    for lines in _read_lines(filename, chunk_size):
+        vertices.append(_parse_block([line[2:] for line in lines if line.startswith('v ')], 3))
+        normals.append(_parse_block([line[3:] for line in lines if line.startswith('vn ')], 3))
+        tex_coords.append(_parse_block([line[3:] for line in lines if line.startswith('vt ')], 2))
 
-            if aux[0] == 'v':
-                vertices += [[float(coord) for coord in aux[1:]]]
+        corners = _triangulate([line[2:] for line in lines if line.startswith('f ')])
+        if len(corners) == 0:
+            continue
 
-            elif aux[0] == 'vn':
-                normals += [[float(coord) for coord in aux[1:]]]
+        assert np.all(corners[:, 1] > 0), "Texture coordinates have not been defined."
 
-            elif aux[0] == 'vt':
-                assert len(aux[1:]) == 2, "Texture coordinates with different than 2 dimensions are not supported"
-                tex_coords += [[float(coord) for coord in aux[1:]]]
+        batch = np.empty((len(corners), 8), dtype=np.float32)
+        batch[:, 0:3] = vertices.view()[corners[:, 0] - 1]
+        batch[:, 3:5] = tex_coords.view()[corners[:, 1] - 1]
+        batch[:, 5:8] = normals.view()[corners[:, 2] - 1]
+        yield batch
 
-            elif aux[0] == 'f':
-                N = len(aux)
-                faces += [[read_face_vertex(face_vertex) for face_vertex in aux[1:4]]]
-                for i in range(3, N-1):
-                    faces += [[read_face_vertex(face_vertex) for face_vertex in [aux[i], aux[i+1], aux[1]]]]
 
-        vertex_data = []
-        indices = []
-        index = 0
+def read_OBJ2_streaming(filename, chunk_size=1 << 22, out=None):
+    """Same output as read_OBJ2, but with memory bounded by the chunk size and the vertex tables.
 
-        # Per previous construction, each face is a triangle
-        for face in faces:
+    out: optional preallocated float32 (N, 8) array to write the vertex data into.
+    """
 
-            # Checking each of the triangle vertices
-            for i in range(0, 3):
-                vertex = vertices[face[i][0]-1]
-                texture = tex_coords[face[i][1]-1]
-                normal = normals[face[i][2]-1]
+    vertex_data = GrowableArray(8, np.float32, out=out)
 
-                vertex_data += [
-                    vertex[0], vertex[1], vertex[2],
-                    texture[0], texture[1],
-                    normal[0], normal[1], normal[2]
-                ]
+    for batch in iter_OBJ2(filename, chunk_size):
+        vertex_data.append(batch)
 
-            # Connecting the 3 vertices to create a triangle
-            indices += [index, index + 1, index + 2]
-            index += 3
+    # Connecting each 3 vertices to create a triangle
+    indices = np.arange(vertex_data.size, dtype=np.uint32)
 
-    return _Shape(vertex_data, indices)
+    return _Shape(vertex_data.view().reshape(-1), indices)
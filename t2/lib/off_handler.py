@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Vectorized reading of .off files and smooth normal generation"""
+
+import numpy as np
+
+
+def read_OFF_arrays(filename):
+    """Reads an .off file, returning its (N, 3) vertices and (M, 3) triangle indices"""
+
+    with open(filename, 'r') as file:
+        line = file.readline().strip()
+        assert line == "OFF"
+
+        aux = file.readline().split()
+        numVertices = int(aux[0])
+        numFaces = int(aux[1])
+
+        lines = file.read().splitlines()
+
+    vertices = np.fromstring(' '.join(lines[:numVertices]), dtype=np.float64, sep=' ')
+    assert len(vertices) == 3 * numVertices, "Only vertices with 3 coordinates are supported."
+    vertices = vertices.reshape((numVertices, 3))
+
+    face_lines = lines[numVertices:numVertices + numFaces]
+    faces = np.fromstring(' '.join(face_lines), dtype=np.int64, sep=' ')
+
+    # Faces may carry extra values (colors, more vertices), only the first triangle is used
+    if len(faces) == 4 * numFaces:
+        faces = faces.reshape((numFaces, 4))
+    else:
+        faces = np.array([line.split()[0:4] for line in face_lines], dtype=np.int64)
+
+    assert np.all(faces[:, 0] >= 3), "Faces must have at least 3 vertices."
+
+    return vertices, faces[:, 1:4]
+
+
+def smooth_normals(vertices, faces, weighting="area"):
+    """Computes per vertex normals as the weighted sum of the normals of its faces.
+
+    weighting: "area" weights each face normal by the face area,
+    "angle" weights it by the angle of the face at that vertex.
+    """
+
+    corners = vertices[faces]
+    edgeA = corners[:, 1] - corners[:, 0]
+    edgeB = corners[:, 2] - corners[:, 1]
+
+    # The cross product length is twice the triangle area
+    face_normals = np.cross(edgeA, edgeB)
+
+    if weighting == "area":
+        corner_normals = np.repeat(face_normals[:, None, :], 3, axis=1)
+
+    elif weighting == "angle":
+        lengths = np.linalg.norm(face_normals, axis=1)
+        unit_normals = face_normals / np.where(lengths == 0, 1, lengths)[:, None]
+
+        # Angle at each corner, between the edges leaving it
+        toNext = np.roll(corners, -1, axis=1) - corners
+        toPrevious = np.roll(corners, 1, axis=1) - corners
+        cosines = np.einsum('ijk,ijk->ij', toNext, toPrevious)
+        cosines /= np.maximum(np.linalg.norm(toNext, axis=2) * np.linalg.norm(toPrevious, axis=2), 1e-30)
+        angles = np.arccos(np.clip(cosines, -1.0, 1.0))
+
+        corner_normals = unit_normals[:, None, :] * angles[:, :, None]
+
+    else:
+        raise ValueError(f"Unknown normal weighting: {weighting}")
+
+    # Scattering every corner contribution into its vertex
+    indices = faces.reshape(-1)
+    corner_normals = corner_normals.reshape((-1, 3))
+    normals = np.stack([
+        np.bincount(indices, weights=corner_normals[:, i], minlength=len(vertices))
+        for i in range(3)], axis=1)
+
+    norms = np.linalg.norm(normals, axis=1)
+    norms[norms == 0] = 1
+    return normals / norms[:, None]
+
+
+def off_vertex_data(filename, color, weighting="area"):
+    """Reads an .off file into (N, 9) position, color and normal rows plus its triangles"""
+
+    vertices, faces = read_OFF_arrays(filename)
+    normals = smooth_normals(vertices, faces, weighting)
+
+    colors = np.tile(np.asarray(color, dtype=np.float64), (len(vertices), 1))
+
+    return np.concatenate((vertices, colors, normals), axis=1), faces
@@ -0,0 +1,140 @@
+# coding=utf-8
+"""Unit quaternions for orientations, single or in batches"""
+
+import numpy as np
+
+# A quaternion is a float64 array (w, x, y, z), w being the real part.
+# Every function also takes (N, 4) stacks, and broadcasts a single
+# quaternion against a stack, returning one result per row.
+# multiply(q1, q2) rotates by q2 first and then by q1, like matmul([R1, R2]).
+
+
+def _quaternions(q):
+    return np.asarray(q, dtype=np.float64)
+
+
+def identity(n=None):
+    if n is None:
+        return np.array([1.0, 0.0, 0.0, 0.0])
+    return np.tile(identity(), (n, 1))
+
+
+def fromAxisAngle(axis, theta):
+    """Rotation of theta radians around axis, both single or one per row"""
+    axis = _quaternions(axis)
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    half = 0.5 * np.asarray(theta, dtype=np.float64)[..., None]
+
+    xyz = np.sin(half) * axis
+    w = np.broadcast_to(np.cos(half), xyz.shape[:-1] + (1,))
+    return np.concatenate((w, xyz), axis=-1)
+
+
+def _elementary(angle, axis):
+    # Rotation around one of the x, y, z axes, like rotationX/Y/Z
+    half = 0.5 * np.asarray(angle, dtype=np.float64)
+    q = np.zeros(half.shape + (4,))
+    q[..., 0] = np.cos(half)
+    q[..., 1 + "xyz".index(axis)] = np.sin(half)
+    return q
+
+
+def fromEuler(angles, order="zyx"):
+    """Euler angles (x, y, z), composed in the given order like transformations.trs does"""
+    angles = _quaternions(angles)
+
+    out = None
+    for axis in order:
+        q = _elementary(angles[..., "xyz".index(axis)], axis)
+        out = q if out is None else multiply(out, q)
+    return out
+
+
+def multiply(q1, q2):
+    q1 = _quaternions(q1)
+    q2 = _quaternions(q2)
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q2, -1, 0)
+
+    return np.stack((
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2), axis=-1)
+
+
+def compose(quaternions):
+    """Like transformations.matmul, the last rotation of the list is applied first"""
+    out = quaternions[0]
+    for i in range(1, len(quaternions)):
+        out = multiply(out, quaternions[i])
+
+    return out
+
+
+def conjugate(q):
+    """Inverse rotation of a unit quaternion"""
+    return _quaternions(q) * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def normalize(q):
+    """Unit quaternions, to undo the drift of many composed rotations"""
+    q = _quaternions(q)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def slerp(q1, q2, t):
+    """Spherical interpolation from q1 (t = 0) to q2 (t = 1), along the shortest arc.
+
+    t may be a single value or one per row.
+    """
+
+    q1 = _quaternions(q1)
+    q2 = _quaternions(q2)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+
+    # q and -q are the same rotation, the closest one is used
+    dot = np.sum(q1 * q2, axis=-1, keepdims=True)
+    q2 = np.where(dot < 0, -q2, q2)
+    dot = np.abs(dot)
+
+    # Almost equal rotations are interpolated linearly, avoiding sin(angle) ~ 0
+    angle = np.arccos(np.clip(dot, -1.0, 1.0))
+    sinAngle = np.sin(angle)
+    close = sinAngle < 1e-6
+    sinAngle = np.where(close, 1.0, sinAngle)
+
+    w1 = np.where(close, 1 - t, np.sin((1 - t) * angle) / sinAngle)
+    w2 = np.where(close, t, np.sin(t * angle) / sinAngle)
+    return normalize(w1 * q1 + w2 * q2)
+
+
+def rotate(q, v):
+    """Vectors v (3,) or (N, 3) rotated by q"""
+    q = _quaternions(q)
+    v = _quaternions(v)
+    w = q[..., 0:1]
+    u = q[..., 1:4]
+
+    t = 2 * np.cross(u, v)
+    return v + w * t + np.cross(u, t)
+
+
+def toMatrix3(q):
+    """3x3 rotation matrices, (3, 3) or (N, 3, 3) float64"""
+    w, x, y, z = np.moveaxis(_quaternions(q), -1, 0)
+
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=-1),
+        np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=-1),
+        np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=-1)), axis=-2)
+
+
+def toMatrix(q):
+    """4x4 transformations, (4, 4) or (N, 4, 4) float32 like the ones of lib.transformations"""
+    rotation = toMatrix3(q)
+
+    out = np.zeros(rotation.shape[:-2] + (4, 4), dtype=np.float32)
+    out[..., 0:3, 0:3] = rotation
+    out[..., 3, 3] = 1
+    return out
@@ -5,6 +5,7 @@ from OpenGL.GL import *
 import OpenGL.GL.shaders
 import numpy as np
 import lib.transformations as tr
+import lib.quaternions as qt
 import lib.gpu_shape as gs
 
 __author__ = "Daniel Calderon"
@@ -17,10 +18,13 @@ class SceneGraphNode:
     Each node represents a group of objects
     Each leaf represents a basic figure (GPUShape)
     To identify each node properly, it MUST have a unique name
+    worldTransform is reused by drawSceneGraphNode to compose the transform
+    of the node with the ones of its parents, instead of allocating a new one.
     """
     def __init__(self, name):
         self.name = name
         self.transform = tr.identity()
+        self.worldTransform = tr.identity()
         self.childs = []
 
     def clear(self):
@@ -29,7 +33,85 @@ class SceneGraphNode:
         for child in self.childs:
             child.clear()
 
-            
+
+
+class QuaternionNode(SceneGraphNode):
+    """
+    A node oriented by a unit quaternion (w, x, y, z) instead of a matrix.
+    Its transform is trs(translation, rotation, scale), built when it is read
+    into a matrix owned by the node, so updating the orientation only touches
+    the four rotation values.
+    """
+    def __init__(self, name, translation=(0, 0, 0), rotation=None, scale=1):
+        super().__init__(name)
+        self.translation = translation
+        self.rotation = qt.identity() if rotation is None else rotation
+        self.scale = scale
+        self.matrix = tr.identity()
+
+    @property
+    def transform(self):
+        return tr.trs(self.translation, self.rotation, self.scale, out=self.matrix)
+
+    @transform.setter
+    def transform(self, transform):
+        # SceneGraphNode.__init__ sets the identity before the parts exist, that is the only write allowed
+        if hasattr(self, "rotation"):
+            raise AttributeError("The transform of a QuaternionNode is built from translation, rotation and scale.")
+
+    def rotate(self, rotation):
+        """Applies rotation, a quaternion, in the local frame of the node"""
+        self.rotation = qt.normalize(qt.multiply(self.rotation, rotation))
+
+
+class ComposedNode(SceneGraphNode):
+    """
+    A node whose transform is prefix * animated * suffix. prefix and suffix
+    are lists of matrices that never change, multiplied once and cached, so
+    every frame only animated is rebuilt and composed with them by update().
+    Without an animated part the transform is just static.
+    """
+    def __init__(self, name, prefix=(), suffix=()):
+        super().__init__(name)
+        self.animated = tr.identity()
+        self.setStatic(prefix, suffix)
+
+    def setStatic(self, prefix=(), suffix=()):
+        """Replaces the static matrices applied after (prefix) and before (suffix) the animated one"""
+        self.prefix = tr.matmul(list(prefix)) if len(prefix) > 0 else None
+        self.suffix = tr.matmul(list(suffix)) if len(suffix) > 0 else None
+        self.factors = [matrix for matrix in (self.prefix, self.animated, self.suffix) if matrix is not None]
+        self.update()
+
+    def update(self, animated=None):
+        """Recomposes transform with a new animated matrix, or with animated already rewritten in place"""
+        if animated is not None:
+            np.copyto(self.animated, animated)
+        tr.matmul(self.factors, out=self.transform)
+
+
+class LODNode(SceneGraphNode):
+    """
+    A node drawing one of several GPUShapes, from the most to the least detailed,
+    e.g. uploaded from mesh_simplify.generateLODs.
+    distances[i] is the camera distance from where level i+1 is used. The distance
+    is divided by the scale of the node, so bigger objects keep their detail longer.
+    """
+    def __init__(self, name, levels, distances):
+        super().__init__(name)
+        assert len(distances) == len(levels) - 1, "A distance is needed for every level after the first one."
+        self.childs = list(levels)
+        self.distances = distances
+
+    def select(self, transform, eye):
+        """GPUShape to draw for a node with this world transform seen from eye"""
+        if eye is None:
+            return self.childs[0]
+
+        scale = np.linalg.norm(transform[0:3, 0:3], axis=0).max()
+        distance = np.linalg.norm(transform[0:3, 3] - eye) / scale
+
+        return self.childs[np.searchsorted(self.distances, distance, side='right')]
 
     
 def findNode(node, name):
@@ -85,22 +167,35 @@ def findPosition(node, name, parentTransform=tr.identity()):
     return None
 
 
-def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity()):
+def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity(), eye=None, batch=None):
+    """batch: a texture_atlas.InstanceBatch, the leaves it accepts are added to it instead of drawn.
+    The transform given to batch.add is reused by the traversal, it has to be copied.
+    """
     assert(isinstance(node, SceneGraphNode))
 
-    # Composing the transformations through this path
-    newTransform = np.matmul(parentTransform, node.transform)
+    # Composing the transformations through this path.
+    # A node shared by several paths reuses its worldTransform, each path is done before the next one
+    newTransform = np.matmul(parentTransform, node.transform, out=node.worldTransform)
+
+    # A level of detail node draws only the level chosen for the camera position
+    if isinstance(node, LODNode):
+        leaf = node.select(newTransform, eye)
+        glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
+        pipeline.drawCall(leaf)
 
     # If the child node is a leaf, it should be a GPUShape.
     # Hence, it can be drawn with drawCall
-    if len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
+    elif len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
         leaf = node.childs[0]
-        glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
-        pipeline.drawCall(leaf)
+        if batch is not None and batch.accepts(leaf):
+            batch.add(leaf, newTransform)
+        else:
+            glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
+            pipeline.drawCall(leaf)
 
     # If the child node is not a leaf, it MUST be a SceneGraphNode,
     # so this draw function is called recursively
     else:
         for child in node.childs:
-            drawSceneGraphNode(child, pipeline, transformName, newTransform)
+            drawSceneGraphNode(child, pipeline, transformName, newTransform, eye, batch)
 
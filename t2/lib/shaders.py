@@ -1,16 +1,17 @@
 from OpenGL.GL import *
 import OpenGL.GL.shaders
-import numpy as np
 from PIL import Image
 
 from lib.gpu_shape import GPUShape
+from lib.texture_upload import uploadImage
 
 SIZE_IN_BYTES = 4
 
 
-def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode):
+def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, immutable=False):
      # wrapMode: GL_REPEAT, GL_CLAMP_TO_EDGE
      # filterMode: GL_LINEAR, GL_NEAREST
+     # immutable: glTexStorage2D allocation, see texture_upload.uploadImage
     texture = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture)
 
@@ -22,20 +23,10 @@ def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMo
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minFilterMode)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, maxFilterMode)
 
-    image = Image.open(imgName)
-    img_data = np.array(image, np.uint8)
-
-    if image.mode == "RGB":
-        internalFormat = GL_RGB
-        format = GL_RGB
-    elif image.mode == "RGBA":
-        internalFormat = GL_RGBA
-        format = GL_RGBA
-    else:
-        print("Image mode not supported.")
-        raise Exception()
-
-    glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, image.size[0], image.size[1], 0, format, GL_UNSIGNED_BYTE, img_data)
+    # imgName may also be an already decoded PIL Image, e.g. from an AssetPreloader.
+    # Other modes than RGB, RGBA, L and LA are converted, see texture_upload.uploadableImage
+    image = imgName if isinstance(imgName, Image.Image) else Image.open(imgName)
+    uploadImage(image, immutable)
 
     return texture
 
@@ -114,7 +105,7 @@ class SimpleModelViewProjectionShaderProgram:
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -196,9 +187,17 @@ class SimpleTextureModelViewProjectionShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glBindSampler(0, gpuShape.sampler or 0)
+
+        if gpuShape.submeshes is None:
+            glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
+            glDrawElements(mode, gpuShape.size, gpuShape.indexType, None)
+        else:
+            # One range of the shared index buffer per material, e.g. from obj_handler.read_OBJ2_materials
+            for submesh in gpuShape.submeshes:
+                texture = gpuShape.texture if submesh.texture is None else submesh.texture
+                glBindTexture(GL_TEXTURE_2D, texture)
+                glDrawElements(mode, submesh.count, gpuShape.indexType, ctypes.c_void_p(submesh.start * gpuShape.indexSize))
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -1,6 +1,3 @@
-import numpy as np
-
-
 class Shape:
     def __init__(self, vertices, indices):
         self.vertices = vertices
@@ -10,6 +7,22 @@ class Shape:
         return "vertices: " + str(self.vertices) + "\n"\
             "indices: " + str(self.indices)
 
+    def optimizeVertexCache(self, stride=None, cacheSize=None, submeshes=None, report=False):
+        """Copy of this indexed triangle shape reordered for the vertex cache, see vertex_cache.optimizeVertexCache.
+        The vertex stride is deduced from the highest index unless it is given.
+        """
+
+        # Imported here since lib.vertex_cache depends on this module
+        import lib.vertex_cache as vc
+
+        if stride is None:
+            vertexCount = max(self.indices) + 1
+            assert len(self.vertices) % vertexCount == 0, "The vertex stride can not be deduced, please provide it."
+            stride = len(self.vertices) // vertexCount
+
+        cacheSize = vc.CACHE_SIZE if cacheSize is None else cacheSize
+        return vc.optimizeVertexCache(self, stride, cacheSize, submeshes, report)
+
 
 def createTextureQuad(nx, ny):
 
@@ -195,77 +208,11 @@ def minecraftCube():
     return Shape(vertices, indices)
 
 
-def read_OFF(filename, color):
-    vertices = []
-    normals = []
-    faces = []
-
-    with open(filename, 'r') as file:
-        line = file.readline().strip()
-        assert line == "OFF"
-
-        line = file.readline().strip()
-        aux = line.split(' ')
-
-        numVertices = int(aux[0])
-        numFaces = int(aux[1])
-
-        for _ in range(numVertices):
-            aux = file.readline().strip().split(' ')
-            vertices += [float(coord) for coord in aux[0:]]
-
-        vertices = np.asarray(vertices)
-        vertices = np.reshape(vertices, (numVertices, 3))
-        # print(f'Vertices shape: {vertices.shape}')
-
-        normals = np.zeros((numVertices,3), dtype=np.float32)
-        # print(f'Normals shape: {normals.shape}')
-
-        for i in range(numFaces):
-            aux = file.readline().strip().split(' ')
-            aux = [int(index) for index in aux[0:]]
-            faces += [aux[1:]]
-
-            vecA = [vertices[aux[2]][0] - vertices[aux[1]][0], vertices[aux[2]][1] - vertices[aux[1]][1], vertices[aux[2]][2] - vertices[aux[1]][2]]
-            vecB = [vertices[aux[3]][0] - vertices[aux[2]][0], vertices[aux[3]][1] - vertices[aux[2]][1], vertices[aux[3]][2] - vertices[aux[2]][2]]
-
-            res = np.cross(vecA, vecB)
-            normals[aux[1]][0] += res[0]
-            normals[aux[1]][1] += res[1]
-            normals[aux[1]][2] += res[2]
-
-            normals[aux[2]][0] += res[0]
-            normals[aux[2]][1] += res[1]
-            normals[aux[2]][2] += res[2]
-
-            normals[aux[3]][0] += res[0]
-            normals[aux[3]][1] += res[1]
-            normals[aux[3]][2] += res[2]
-        # print(faces)
-        norms = np.linalg.norm(normals, axis=1)
-        normals = normals/norms[:, None]
-
-        color = np.asarray(color)
-        color = np.tile(color, (numVertices, 1))
-
-        vertexData = np.concatenate((vertices, color), axis=1)
-        vertexData = np.concatenate((vertexData, normals), axis=1)
-
-        # print(vertexData.shape)
-
-        indices = []
-        vertexDataF = []
-        index = 0
-
-        for face in faces:
-            vertex = vertexData[face[0],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[1],:]
-            vertexDataF += vertex.tolist()
-            vertex = vertexData[face[2],:]
-            vertexDataF += vertex.tolist()
+def read_OFF(filename, color, indexed=False, weighting="area"):
 
-            indices += [index, index + 1, index + 2]
-            index += 3
+    # Parsed geometry is memoized by lib.mesh_loader, only the color is applied per call
+    # Imported here since lib.mesh_loader depends on this module
+    from lib.mesh_loader import load_mesh
+    shape = load_mesh(filename, color, indexed, weighting)
 
-    return Shape(vertexDataF, indices)
+    return Shape(shape.vertices, shape.indices)
@@ -0,0 +1,177 @@
+# coding=utf-8
+"""Packing several images into one texture, as array layers or atlas regions"""
+
+from OpenGL.GL import *
+import numpy as np
+from PIL import Image
+
+from lib.basic_shapes import Shape
+from lib.texture_cache import CachedTexture
+
+
+def _openRGBA(image):
+    if isinstance(image, CachedTexture):
+        image = image.toImage()
+    image = image if isinstance(image, Image.Image) else Image.open(image)
+    return image if image.mode == "RGBA" else image.convert("RGBA")
+
+
+class TextureArray:
+    """A GL_TEXTURE_2D_ARRAY handle and the layer of every packed image name"""
+
+    def __init__(self, texture, layers, size):
+        self.texture = texture
+        self.layers = layers
+        self.size = size
+
+    def clear(self):
+        glDeleteTextures(1, [self.texture])
+
+
+def packTextureArray(images, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, size=None, mipmaps=True):
+    """Uploads a dict of name: image (PIL Image, CachedTexture or file) as the layers of a texture array.
+
+    Layers share one size, by default the largest width and height of the
+    images, smaller images are scaled with nearest neighbour filtering.
+    """
+
+    images = {name: _openRGBA(image) for name, image in images.items()}
+    if size is None:
+        size = (max(image.size[0] for image in images.values()), max(image.size[1] for image in images.values()))
+
+    pixels = np.stack([np.asarray(image.resize(size, Image.NEAREST), dtype=np.uint8) for image in images.values()])
+    layers = {name: layer for layer, name in enumerate(images)}
+
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, sWrapMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, tWrapMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, minFilterMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, maxFilterMode)
+
+    glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_RGBA8, size[0], size[1], len(layers), 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+    if mipmaps:
+        glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+
+    glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+    return TextureArray(texture, layers, size)
+
+
+def packAtlas(images, padding=2):
+    """Packs a dict of name: image (PIL Image, CachedTexture or file) into one RGBA atlas image.
+
+    Images are placed in rows, tallest first, inside a square power of two
+    atlas. Each one is surrounded by padding texels copied from its border,
+    so filtering does not bleed the neighbours in.
+    Returns the atlas and, per name, its (u0, v0, u1, v1) texture coordinates.
+    """
+
+    images = {name: _openRGBA(image) for name, image in images.items()}
+    order = sorted(images, key=lambda name: images[name].size[1], reverse=True)
+
+    area = sum((w + 2 * padding) * (h + 2 * padding) for w, h in (image.size for image in images.values()))
+    side = 1 << int(np.ceil(np.log2(max(np.sqrt(area), max(max(image.size) + 2 * padding for image in images.values())))))
+
+    while True:
+        placements, x, y, rowHeight = {}, 0, 0, 0
+        for name in order:
+            w, h = images[name].size[0] + 2 * padding, images[name].size[1] + 2 * padding
+            if x + w > side:
+                x, y, rowHeight = 0, y + rowHeight, 0
+            placements[name] = (x, y)
+            x, rowHeight = x + w, max(rowHeight, h)
+
+        if y + rowHeight <= side:
+            break
+        side *= 2
+
+    atlas = np.zeros((side, side, 4), dtype=np.uint8)
+    rects = {}
+    for name, (x, y) in placements.items():
+        pixels = np.pad(np.asarray(images[name], dtype=np.uint8), ((padding, padding), (padding, padding), (0, 0)), mode='edge')
+        atlas[y:y + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+
+        w, h = images[name].size
+        rects[name] = ((x + padding) / side, (y + padding) / side, (x + padding + w) / side, (y + padding + h) / side)
+
+    return Image.fromarray(atlas), rects
+
+
+def remapTexCoords(shape, rect, stride=5, offset=3):
+    """Copy of a textured shape with its texture coordinates moved into an atlas rect.
+
+    Texture coordinates must lie in [0, 1], repeating textures can not be atlased.
+    """
+
+    u0, v0, u1, v1 = rect
+    vertices = np.array(shape.vertices, dtype=np.float32).reshape((-1, stride))
+    vertices[:, offset] = u0 + vertices[:, offset] * (u1 - u0)
+    vertices[:, offset + 1] = v0 + vertices[:, offset + 1] * (v1 - v0)
+
+    return Shape(vertices.reshape(-1), shape.indices, stride)
+
+
+class InstanceBatch:
+    """
+    Collects the shapes sharing one geometry and drawn with different layers of
+    a texture array, then draws all of them with a single instanced call.
+    gpuShape must be set up for pipeline, a TextureArrayInstancedShaderProgram.
+    Shapes are registered with assign, and the scene graph hands them over
+    while traversing, see scene_graph.drawSceneGraphNode.
+    """
+
+    def __init__(self, pipeline, gpuShape, textureArray):
+        self.pipeline = pipeline
+        self.gpuShape = gpuShape
+        self.textureArray = textureArray
+        gpuShape.texture = textureArray.texture
+
+        self.layers = {}
+
+        # Instance data of this frame, kept between frames and grown when needed
+        self.data = np.empty((0, 17), dtype=np.float32)
+        self.count = 0
+
+        self.instanceVbo = glGenBuffers(1)
+        pipeline.setupInstances(gpuShape, self.instanceVbo)
+
+    def assign(self, leaf, layerName):
+        """Draws leaf, wherever it appears in the scene graph, with this layer"""
+        self.layers[leaf] = self.textureArray.layers[layerName]
+
+    def accepts(self, leaf):
+        return leaf in self.layers
+
+    def add(self, leaf, transform):
+        """Copies transform, the scene graph reuses its matrices while traversing"""
+        if self.count == len(self.data):
+            data = np.empty((max(16, 2 * len(self.data)), 17), dtype=np.float32)
+            data[0:self.count] = self.data
+            self.data = data
+
+        # GLSL reads mat4 attributes by columns
+        np.copyto(self.data[self.count, 0:16].reshape((4, 4)), np.transpose(transform))
+        self.data[self.count, 16] = self.layers[leaf]
+        self.count += 1
+
+    def draw(self, mode=GL_TRIANGLES):
+        """Draws and forgets every instance added since the last draw"""
+
+        count = self.count
+        if count == 0:
+            return
+
+        data = self.data[0:count]
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVbo)
+        glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STREAM_DRAW)
+
+        self.pipeline.drawCall(self.gpuShape, count, mode)
+
+        self.count = 0
+
+    def clear(self):
+        """Freeing the instance buffer and the shape, the texture array belongs to its owner"""
+        glDeleteBuffers(1, [self.instanceVbo])
+        self.gpuShape.texture = None
+        self.gpuShape.clear()
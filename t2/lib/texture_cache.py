@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Binary cache of decoded texture pixels, to skip image decoding on warm starts"""
+
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from PIL import Image
+
+from lib.cache_files import write_entry
+from lib.texture_upload import mipChain, uploadableImage
+
+# Cached textures are stored next to their source file, inside this folder
+CACHE_DIRECTORY = ".texture_cache"
+
+
+class CachedTexture:
+    """
+    Decoded pixels of an image: its mode, (width, height) size and mipmap
+    levels as (height, width, channels) uint8 arrays, level 0 first.
+    Levels loaded from the cache are read-only views of a memory mapped file.
+    """
+
+    def __init__(self, mode, size, levels):
+        self.mode = mode
+        self.size = size
+        self.levels = levels
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def toImage(self):
+        pixels = np.asarray(self.levels[0])
+
+        # Single channel images are 2d arrays for PIL
+        if pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+        return Image.fromarray(pixels, self.mode)
+
+
+def _source_hash(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:16]
+
+
+def _cache_paths(filename, digest, mipmaps):
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRECTORY)
+    variant = "mips" if mipmaps else "base"
+    base = os.path.join(directory, f"{os.path.basename(filename)}.{digest}.{variant}")
+    stale = os.path.join(directory, f"{glob.escape(os.path.basename(filename))}.*.{variant}.*")
+    return directory, base + ".npy", base + ".json", stale
+
+
+def _read_cache(pixels_path, meta_path):
+    """Returns the cached texture, or None when it is missing or unreadable"""
+
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        pixels = np.load(pixels_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+    # Every level is a contiguous slice of the mapped file, no copy is made
+    levels = []
+    for height, width, channels, offset in meta["levels"]:
+        levels += [pixels[offset:offset + height * width * channels].reshape((height, width, channels))]
+
+    return CachedTexture(meta["mode"], tuple(meta["size"]), levels)
+
+
+def decode_texture(filename, mipmaps=False):
+    """Decodes an image file into a CachedTexture, without touching the cache"""
+
+    image = uploadableImage(Image.open(filename))
+    pixels = np.asarray(image, dtype=np.uint8).reshape((image.size[1], image.size[0], -1))
+    levels = mipChain(pixels) if mipmaps else [pixels]
+    return CachedTexture(image.mode, image.size, levels)
+
+
+def load_cached_texture(filename, mipmaps=False):
+    """Decoded pixels of an image file, reusing a binary cache.
+
+    The pixels of every level (all the mip chain when mipmaps is True)
+    are stored raw in one .npy file, keyed by a hash of the source file
+    contents. Warm starts memory map it and hand out views of the mapped
+    file, ready for glTexImage2D, so PNG decoding is skipped entirely.
+    """
+
+    digest = _source_hash(filename)
+    directory, pixels_path, meta_path, stale = _cache_paths(filename, digest, mipmaps)
+
+    texture = _read_cache(pixels_path, meta_path)
+    if texture is not None:
+        return texture
+
+    texture = decode_texture(filename, mipmaps)
+
+    offsets = np.cumsum([0] + [level.size for level in texture.levels])
+    meta = {
+        "mode": texture.mode,
+        "size": list(texture.size),
+        "levels": [list(level.shape) + [int(offset)] for level, offset in zip(texture.levels, offsets)]
+    }
+
+    # Entries of previous versions of the source are not needed anymore
+    write_entry(directory, [(pixels_path, np.concatenate([level.reshape(-1) for level in texture.levels]))],
+        meta_path, meta, stale=glob.glob(stale))
+
+    return texture
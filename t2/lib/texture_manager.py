@@ -0,0 +1,183 @@
+# coding=utf-8
+"""Shared GL textures, deduplicated by image file and sampling parameters"""
+
+import os
+from collections import OrderedDict
+from OpenGL.GL import *
+from PIL import Image
+
+from lib.easy_shaders import textureSimpleSetup
+from lib.texture_upload import textureMipmapSetup, Sampler
+from lib.texture_cache import CachedTexture, load_cached_texture
+
+# Bytes per texel of the image modes uploaded as they are, other ones are estimated as RGBA
+BYTES_PER_TEXEL = {"RGB": 3, "RGBA": 4, "L": 1, "LA": 2}
+
+
+class TextureEntry:
+    """A GL texture handle with its users count and estimated video memory"""
+
+    def __init__(self, key, texture, width, height, nbytes):
+        self.key = key
+        self.texture = texture
+        self.width = width
+        self.height = height
+        self.nbytes = nbytes
+        self.references = 0
+
+
+class TextureManager:
+    """
+    Uploads each image once per wrap and filter modes and shares the handle.
+    acquire() and release() count the users of every texture.
+    Without a budget a texture is deleted as soon as its last user releases it.
+    With a budget (in bytes) unused textures stay resident, ready to be
+    acquired again, until the estimated video memory exceeds the budget;
+    then the least recently used unused ones are deleted first.
+    Textures uploaded with mipmaps, compression or from cached pixels are
+    sampled through shared Sampler objects, so their key is only the file
+    and upload options. With cache=True images are read through
+    texture_cache.load_cached_texture instead of being decoded.
+    """
+
+    def __init__(self, budget=None, cache=False):
+        self.budget = budget
+        self.cache = cache
+        self.entries = OrderedDict()
+        self.byHandle = {}
+        self.samplers = {}
+        self.vramBytes = 0
+        self.uploads = 0
+        self.hits = 0
+
+    def acquire(self, filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, image=None,
+            mipmaps=None, compressed=False):
+        """GL texture of an image file, image may be the already decoded PIL Image of that file.
+
+        image may also be a texture_cache.CachedTexture.
+        With mipmaps ("cpu" or "gpu"), compressed or cached pixels, the texture
+        is uploaded by texture_upload.textureMipmapSetup and needs a sampler, see assign.
+        """
+
+        sampled = self._sampled(image, mipmaps, compressed)
+        if not sampled:
+            key = (os.path.abspath(filename), sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+        else:
+            key = (os.path.abspath(filename), mipmaps, compressed)
+
+        entry = self.entries.get(key)
+        if entry is None:
+            if image is None and self.cache:
+                image = load_cached_texture(filename, mipmaps == "cpu")
+            elif image is None:
+                image = Image.open(filename)
+
+            width, height = image.size
+            if not sampled:
+                texture = textureSimpleSetup(image, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+                nbytes = width * height * BYTES_PER_TEXEL.get(image.mode, 4)
+            else:
+                texture, nbytes = textureMipmapSetup(image, mipmaps, compressed)
+            entry = TextureEntry(key, texture, width, height, nbytes)
+
+            self.entries[key] = entry
+            self.byHandle[texture] = entry
+            self.vramBytes += entry.nbytes
+            self.uploads += 1
+        else:
+            self.hits += 1
+
+        # Most recently used entries live at the end
+        self.entries.move_to_end(key)
+        entry.references += 1
+
+        self.evict()
+        return entry.texture
+
+    def assign(self, gpuShape, filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, image=None,
+            mipmaps=None, compressed=False):
+        """Acquires a texture for gpuShape, gpuShape.clear() will release it back to this manager"""
+        gpuShape.releaseTexture()
+        gpuShape.texture = self.acquire(filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, image,
+            mipmaps, compressed)
+        gpuShape.textureManager = self
+
+        if self._sampled(image, mipmaps, compressed):
+            gpuShape.sampler = self.sampler(sWrapMode, tWrapMode, minFilterMode, maxFilterMode).sampler
+
+    def assignSubmeshes(self, gpuShape, sWrapMode, tWrapMode, minFilterMode, maxFilterMode,
+            mipmaps=None, compressed=False):
+        """Acquires the map_Kd texture of every submesh material, gpuShape.clear() will release them.
+
+        Submeshes without map_Kd keep drawing with the texture of gpuShape.
+        """
+        gpuShape.releaseSubmeshTextures()
+
+        for submesh in gpuShape.submeshes or []:
+            filename = (submesh.material or {}).get("map_Kd")
+            if filename is None:
+                continue
+
+            submesh.texture = self.acquire(filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode,
+                mipmaps=mipmaps, compressed=compressed)
+            submesh.textureManager = self
+
+            if self._sampled(None, mipmaps, compressed):
+                gpuShape.sampler = self.sampler(sWrapMode, tWrapMode, minFilterMode, maxFilterMode).sampler
+
+    def _sampled(self, image, mipmaps, compressed):
+        """Whether a texture goes through textureMipmapSetup and a Sampler"""
+        return mipmaps is not None or compressed or self.cache or isinstance(image, CachedTexture)
+
+    def sampler(self, sWrapMode, tWrapMode, minFilterMode, magFilterMode, anisotropy=None):
+        """Shared Sampler for these wrap and filter modes"""
+        key = (sWrapMode, tWrapMode, minFilterMode, magFilterMode, anisotropy)
+        if key not in self.samplers:
+            self.samplers[key] = Sampler(*key)
+        return self.samplers[key]
+
+    def release(self, texture):
+        entry = self.byHandle[texture]
+        assert entry.references > 0, "Texture released more times than acquired."
+        entry.references -= 1
+
+        if entry.references == 0 and self.budget is None:
+            self._delete(entry)
+        else:
+            self.evict()
+
+    def evict(self):
+        """Deletes unused textures, least recently used first, while over budget"""
+        if self.budget is None:
+            return
+
+        for entry in list(self.entries.values()):
+            if self.vramBytes <= self.budget:
+                break
+            if entry.references == 0:
+                self._delete(entry)
+
+    def _delete(self, entry):
+        glDeleteTextures(1, [entry.texture])
+        del self.entries[entry.key]
+        del self.byHandle[entry.texture]
+        self.vramBytes -= entry.nbytes
+
+    def clear(self):
+        """Deletes every texture and sampler, used or not"""
+        for entry in list(self.entries.values()):
+            self._delete(entry)
+
+        for sampler in self.samplers.values():
+            sampler.clear()
+        self.samplers = {}
+
+    def report(self):
+        """Prints the resident textures and the estimated video memory they use"""
+        print(f"Textures: {len(self.entries)} resident, {self.uploads} uploads, {self.hits} shared")
+        for (filename, *_), entry in self.entries.items():
+            print(f"  {os.path.basename(filename):<24} {entry.width}x{entry.height}"
+                f"  {entry.nbytes / 2**20:7.2f} MiB  users={entry.references}")
+
+        budget = "" if self.budget is None else f" of {self.budget / 2**20:.2f} MiB budget"
+        print(f"  estimated VRAM {self.vramBytes / 2**20:.2f} MiB{budget}")
@@ -0,0 +1,188 @@
+# coding=utf-8
+"""Texture uploads: image formats, mipmaps, compression, and sampler objects"""
+
+import os
+from OpenGL.GL import *
+import numpy as np
+from PIL import Image
+
+# From EXT_texture_filter_anisotropic, core since OpenGL 4.6
+TEXTURE_MAX_ANISOTROPY = 0x84FE
+
+# Pixel format, uncompressed and generic compressed internal formats and swizzle
+# per image mode uploaded as it is, with compression the driver picks the block format.
+# Gray images keep 1 or 2 channels and are expanded by the swizzle when sampled.
+FORMATS = {
+    "RGB": (GL_RGB, GL_RGB8, GL_COMPRESSED_RGB, None),
+    "RGBA": (GL_RGBA, GL_RGBA8, GL_COMPRESSED_RGBA, None),
+    "L": (GL_RED, GL_R8, GL_COMPRESSED_RED, [GL_RED, GL_RED, GL_RED, GL_ONE]),
+    "LA": (GL_RG, GL_RG8, GL_COMPRESSED_RG, [GL_RED, GL_RED, GL_RED, GL_GREEN]),
+}
+
+
+class TextureFormatError(ValueError):
+    """An image mode that can not be uploaded as a texture"""
+
+
+def uploadableImage(image):
+    """The image in one of the FORMATS modes, converting it only when needed"""
+
+    if image.mode in FORMATS:
+        return image
+
+    # Palettes are expanded, with alpha only if some entry is transparent
+    if image.mode in ("P", "PA"):
+        return image.convert("RGBA" if image.mode == "PA" or "transparency" in image.info else "RGB")
+
+    if image.mode == "1":
+        return image.convert("L")
+
+    try:
+        return image.convert("RGBA")
+    except ValueError as error:
+        raise TextureFormatError(f"Image mode {image.mode} can not be uploaded as a texture.") from error
+
+
+def unpackAlignment(rowBytes):
+    """Largest GL_UNPACK_ALIGNMENT matching rows of this many bytes, e.g. 1 for odd RGB widths"""
+    for alignment in (8, 4, 2, 1):
+        if rowBytes % alignment == 0:
+            return alignment
+
+
+def uploadImage(image, immutable=False):
+    """Uploads a PIL Image as level 0 of the texture bound to GL_TEXTURE_2D.
+
+    Image.tobytes() is the only copy of the pixels, OpenGL reads that buffer
+    as it is. immutable allocates the texture with glTexStorage2D (OpenGL 4.2),
+    its size and format can not change afterwards.
+    """
+
+    image = uploadableImage(image)
+    format, internalFormat, _, swizzle = FORMATS[image.mode]
+    width, height = image.size
+    data = image.tobytes()
+
+    glPixelStorei(GL_UNPACK_ALIGNMENT, unpackAlignment(width * len(image.getbands())))
+
+    if immutable:
+        glTexStorage2D(GL_TEXTURE_2D, 1, internalFormat, width, height)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, width, height, format, GL_UNSIGNED_BYTE, data)
+    else:
+        glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, width, height, 0, format, GL_UNSIGNED_BYTE, data)
+
+    if swizzle is not None:
+        glTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_RGBA, swizzle)
+
+
+def mipChain(pixels):
+    """Every mipmap level of an (height, width, channels) uint8 array, level 0 first.
+
+    Each level averages 2x2 blocks of the previous one. Level sizes are
+    halved and rounded down, like OpenGL does, so with odd sizes the last
+    row or column does not contribute to the next level.
+    """
+
+    levels = [pixels]
+    current = pixels.astype(np.float32)
+
+    while current.shape[0] > 1 or current.shape[1] > 1:
+        height, width = current.shape[0], current.shape[1]
+        if height > 1:
+            current = 0.5 * (current[0:height // 2 * 2:2] + current[1:height // 2 * 2:2])
+        if width > 1:
+            current = 0.5 * (current[:, 0:width // 2 * 2:2] + current[:, 1:width // 2 * 2:2])
+        levels += [np.round(current).astype(np.uint8)]
+
+    return levels
+
+
+def textureMipmapSetup(imgName, mipmaps="cpu", compressed=False):
+    """Uploads an image with its mipmap levels, returns the texture and its estimated bytes.
+
+    imgName may be a file, a PIL Image or a texture_cache.CachedTexture.
+    mipmaps: "cpu" to build the levels with mipChain, "gpu" for glGenerateMipmap
+    or None for level 0 only.
+    compressed: store the texture in a GPU compressed internal format. Its
+    levels are always built with mipChain, as glGenerateMipmap does not
+    support compressed formats.
+    Sampling is left to a Sampler object bound with the texture.
+    """
+
+    if isinstance(imgName, (str, os.PathLike)):
+        imgName = Image.open(imgName)
+
+    if isinstance(imgName, Image.Image):
+        image = uploadableImage(imgName)
+        pixels = np.asarray(image, dtype=np.uint8).reshape((image.size[1], image.size[0], -1))
+        mode, size, levels = image.mode, image.size, [pixels]
+    else:
+        # A texture_cache.CachedTexture, already decoded and maybe with its mip chain
+        mode, size, levels = imgName.mode, imgName.size, imgName.levels
+
+    format, internalFormat, compressedFormat, swizzle = FORMATS[mode]
+    if compressed:
+        internalFormat = compressedFormat
+        if mipmaps == "gpu":
+            mipmaps = "cpu"
+
+    if mipmaps == "cpu" and len(levels) == 1:
+        levels = mipChain(levels[0])
+    elif mipmaps != "cpu":
+        levels = levels[0:1]
+    pixels = levels[0]
+
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+
+    # Rows of small levels are not 4 bytes aligned
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    for level, data in enumerate(levels):
+        glTexImage2D(GL_TEXTURE_2D, level, internalFormat, data.shape[1], data.shape[0], 0, format, GL_UNSIGNED_BYTE, data)
+
+    if mipmaps == "gpu":
+        glGenerateMipmap(GL_TEXTURE_2D)
+        levelCount = int(np.log2(max(size))) + 1
+    else:
+        levelCount = len(levels)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, levelCount - 1)
+
+    if swizzle is not None:
+        glTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_RGBA, swizzle)
+
+    # Generic compressed formats may still be stored uncompressed, those levels are estimated
+    width, height = size
+    nbytes = 0
+    for level in range(levelCount):
+        if compressed and glGetTexLevelParameteriv(GL_TEXTURE_2D, level, GL_TEXTURE_COMPRESSED):
+            nbytes += glGetTexLevelParameteriv(GL_TEXTURE_2D, level, GL_TEXTURE_COMPRESSED_IMAGE_SIZE)
+        else:
+            nbytes += width * height * pixels.shape[2]
+        width, height = max(1, width // 2), max(1, height // 2)
+
+    return texture, int(nbytes)
+
+
+class Sampler:
+    """
+    Wrap and filter modes in a GL sampler object. Bound to a texture unit,
+    it overrides the parameters of whatever texture is bound there, so one
+    sampler serves every texture sampled the same way.
+    """
+
+    def __init__(self, sWrapMode, tWrapMode, minFilterMode, magFilterMode, anisotropy=None):
+        self.sampler = glGenSamplers(1)
+
+        glSamplerParameteri(self.sampler, GL_TEXTURE_WRAP_S, sWrapMode)
+        glSamplerParameteri(self.sampler, GL_TEXTURE_WRAP_T, tWrapMode)
+        glSamplerParameteri(self.sampler, GL_TEXTURE_MIN_FILTER, minFilterMode)
+        glSamplerParameteri(self.sampler, GL_TEXTURE_MAG_FILTER, magFilterMode)
+
+        if anisotropy is not None:
+            glSamplerParameterf(self.sampler, TEXTURE_MAX_ANISOTROPY, anisotropy)
+
+    def bind(self, unit=0):
+        glBindSampler(unit, self.sampler)
+
+    def clear(self):
+        glDeleteSamplers(1, [self.sampler])
@@ -1,65 +1,90 @@
 # coding=utf-8
 """Transformation matrices for computer graphics"""
 
+import math
 import numpy as np
+import lib.quaternions as qt
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
-def identity():
-    return np.identity(4, dtype=np.float32)
+# Every constructor takes an optional out, a preallocated 4x4 array that is
+# filled in place and returned, instead of allocating a new matrix.
 
+_IDENTITY = np.identity(4, dtype=np.float32)
 
-def uniformScale(s):
-    return np.array([
-        [s,0,0,0],
-        [0,s,0,0],
-        [0,0,s,0],
-        [0,0,0,1]], dtype = np.float32)
 
+def _matrix(values, out):
+    """4x4 matrix of 16 values by rows, written into out when it is given"""
+    if out is None:
+        return np.array(values, dtype = np.float32).reshape((4, 4))
 
-def scale(sx, sy, sz):
-    return np.array([
-        [sx,0,0,0],
-        [0,sy,0,0],
-        [0,0,sz,0],
-        [0,0,0,1]], dtype = np.float32)
+    out.flat = values
+    return out
+
+
+def identity(out=None):
+    if out is None:
+        return np.identity(4, dtype=np.float32)
+
+    np.copyto(out, _IDENTITY)
+    return out
+
+
+def uniformScale(s, out=None):
+    return _matrix((
+        s,0,0,0,
+        0,s,0,0,
+        0,0,s,0,
+        0,0,0,1), out)
 
 
-def rotationX(theta):
+def scale(sx, sy, sz, out=None):
+    return _matrix((
+        sx,0,0,0,
+        0,sy,0,0,
+        0,0,sz,0,
+        0,0,0,1), out)
+
+
+def rotationX(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [1,0,0,0],
-        [0,cos_theta,-sin_theta,0],
-        [0,sin_theta,cos_theta,0],
-        [0,0,0,1]], dtype = np.float32)
+    return _matrix((
+        1,0,0,0,
+        0,cos_theta,-sin_theta,0,
+        0,sin_theta,cos_theta,0,
+        0,0,0,1), out)
 
 
-def rotationY(theta):
+def rotationY(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [cos_theta,0,sin_theta,0],
-        [0,1,0,0],
-        [-sin_theta,0,cos_theta,0],
-        [0,0,0,1]], dtype = np.float32)
+    return _matrix((
+        cos_theta,0,sin_theta,0,
+        0,1,0,0,
+        -sin_theta,0,cos_theta,0,
+        0,0,0,1), out)
 
 
-def rotationZ(theta):
+def rotationZ(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [cos_theta,-sin_theta,0,0],
-        [sin_theta,cos_theta,0,0],
-        [0,0,1,0],
-        [0,0,0,1]], dtype = np.float32)
+    return _matrix((
+        cos_theta,-sin_theta,0,0,
+        sin_theta,cos_theta,0,0,
+        0,0,1,0,
+        0,0,0,1), out)
 
 
-def rotationA(theta, axis):
+def rotationA(theta, axis, quaternion=False, out=None):
+    """quaternion: build it from the unit quaternion of theta and axis, see lib.quaternions"""
+    if quaternion:
+        return trs((0, 0, 0), qt.fromAxisAngle(axis, theta), out=out)
+
     s = np.sin(theta)
     c = np.cos(theta)
 
@@ -69,28 +94,38 @@ def rotationA(theta, axis):
     y = axis[1]
     z = axis[2]
 
-    return np.array([
+    return _matrix((
         # First row
-        [c + (1 - c) * x * x,
+        c + (1 - c) * x * x,
         (1 - c) * x * y - s * z,
         (1 - c) * x * z + s * y,
-        0],
+        0,
         # Second row
-        [(1 - c) * x * y + s * z,
+        (1 - c) * x * y + s * z,
         c + (1 - c) * y * y,
         (1 - c) * y * z - s * x,
-        0],
+        0,
         # Third row
-        [(1 - c) * x * z - s * y,
+        (1 - c) * x * z - s * y,
         (1 - c) * y * z + s * x,
         c + (1 - c) * z * z,
-        0],
+        0,
         # Fourth row
-        [0,0,0,1]], dtype = np.float32)
+        0,0,0,1), out)
+
+def rotationAxis(theta, point1, point2, quaternion=False, out=None):
+    """Rotation around the line from point1 to point2.
 
-def rotationAxis(theta, point1, point2):
+    quaternion: rotate with one quaternion and translate point1 back in place,
+    instead of multiplying seven matrices. It also works for axes parallel to y.
+    """
     axis = point2-point1
     axis = axis / np.linalg.norm(axis)
+
+    if quaternion:
+        q = qt.fromAxisAngle(axis, theta)
+        return trs(point1 - qt.rotate(q, point1), q, out=out)
+
     a,b,c = axis
     h = np.sqrt(a**2 + c**2)
 
@@ -123,85 +158,321 @@ def rotationAxis(theta, point1, point2):
     
     Rx = rotationX(theta)
 
-    return matmul([Tinv,Ryinv,Rzinv,Rx,Rz,Ry,T])
+    return matmul([Tinv,Ryinv,Rzinv,Rx,Rz,Ry,T], out)
     
-def translate(tx, ty, tz):
-    return np.array([
-        [1,0,0,tx],
-        [0,1,0,ty],
-        [0,0,1,tz],
-        [0,0,0,1]], dtype = np.float32)
+def translate(tx, ty, tz, out=None):
+    return _matrix((
+        1,0,0,tx,
+        0,1,0,ty,
+        0,0,1,tz,
+        0,0,0,1), out)
+
+
+def shearing(xy, yx, xz, zx, yz, zy, out=None):
+    return _matrix((
+         1, xy, xz, 0,
+        yx,  1, yz, 0,
+        zx, zy,  1, 0,
+         0,  0,  0, 1), out)
+
+
+def matmul(mats, out=None):
+    """out may be the first of mats, but none of the other ones"""
+    if out is None:
+        out = mats[0]
+        for i in range(1, len(mats)):
+            out = np.matmul(out, mats[i])
+
+        return out
+
+    if len(mats) == 1:
+        np.copyto(out, mats[0])
+        return out
+
+    np.matmul(mats[0], mats[1], out=out)
+    for i in range(2, len(mats)):
+        np.matmul(out, mats[i], out=out)
+
+    return out
+
+
+# Batched versions of the constructors above.
+# Arguments may be scalars or 1d arrays of a common length N, the result
+# is an (N, 4, 4) float32 stack with one transformation per element,
+# written into out when an (N, 4, 4) array is given. Entries are written
+# straight into the result, so with out and array arguments nothing new
+# is allocated.
+
+def _batch(*values):
+    """Broadcasts scalars and arrays to 1d arrays of a common length"""
+    return np.broadcast_arrays(*[np.asarray(value, dtype=np.float64).reshape(-1) for value in values])
+
+
+def _batchLength(out, *values):
+    if out is not None:
+        return len(out)
+    return np.broadcast(*values).size
+
+
+def identityBatch(n, out=None):
+    if out is None:
+        return np.tile(np.identity(4, dtype=np.float32), (n, 1, 1))
+
+    out[...] = _IDENTITY
+    return out
+
+
+def uniformScaleBatch(s, out=None):
+    return scaleBatch(s, s, s, out)
+
+
+def scaleBatch(sx, sy, sz, out=None):
+    out = identityBatch(_batchLength(out, sx, sy, sz), out)
+    out[:, 0, 0] = sx
+    out[:, 1, 1] = sy
+    out[:, 2, 2] = sz
+    return out
+
+
+def translateBatch(tx, ty, tz, out=None):
+    out = identityBatch(_batchLength(out, tx, ty, tz), out)
+    out[:, 0, 3] = tx
+    out[:, 1, 3] = ty
+    out[:, 2, 3] = tz
+    return out
+
+
+def _planeRotation3Batch(theta, i, j):
+    # 3x3 rotations in the plane of the axes i and j, the same layout as rotationX/Y/Z
+    theta, = _batch(theta)
+    sin_theta = np.sin(theta)
+    cos_theta = np.cos(theta)
+
+    out = np.tile(np.identity(3), (len(theta), 1, 1))
+    out[:, i, i] = cos_theta
+    out[:, i, j] = -sin_theta
+    out[:, j, i] = sin_theta
+    out[:, j, j] = cos_theta
+    return out
+
+
+def _planeRotationBatch(theta, i, j, out):
+    out = identityBatch(_batchLength(out, theta), out)
+
+    # sin and cos are evaluated into the result, the other two entries are copied from them
+    np.cos(theta, out=out[:, i, i])
+    np.sin(theta, out=out[:, j, i])
+    np.negative(out[:, j, i], out=out[:, i, j])
+    out[:, j, j] = out[:, i, i]
+    return out
+
 
+def rotationXBatch(theta, out=None):
+    return _planeRotationBatch(theta, 1, 2, out)
 
-def shearing(xy, yx, xz, zx, yz, zy):
-    return np.array([
-        [ 1, xy, xz, 0],
-        [yx,  1, yz, 0],
-        [zx, zy,  1, 0],
-        [ 0,  0,  0, 1]], dtype = np.float32)
 
+def rotationYBatch(theta, out=None):
+    return _planeRotationBatch(theta, 2, 0, out)
 
-def matmul(mats):
-    out = mats[0]
-    for i in range(1, len(mats)):
-        out = np.matmul(out, mats[i])
 
+def rotationZBatch(theta, out=None):
+    return _planeRotationBatch(theta, 0, 1, out)
+
+
+def rotationABatch(theta, axis, out=None):
+    """axis is a single (3,) unit axis or one per angle, as an (N, 3) array"""
+    axis = np.asarray(axis, dtype=np.float64).reshape((-1, 3))
+    theta, x, y, z = _batch(theta, axis[:, 0], axis[:, 1], axis[:, 2])
+
+    s = np.sin(theta)
+    c = np.cos(theta)
+    t = 1 - c
+
+    out = identityBatch(len(theta), out)
+    out[:, 0, 0:3] = np.stack((c + t * x * x, t * x * y - s * z, t * x * z + s * y), axis=1)
+    out[:, 1, 0:3] = np.stack((t * x * y + s * z, c + t * y * y, t * y * z - s * x), axis=1)
+    out[:, 2, 0:3] = np.stack((t * x * z - s * y, t * y * z + s * x, c + t * z * z), axis=1)
     return out
 
 
-def frustum(left, right, bottom, top, near, far):
+def matmulBatch(mats, out=None):
+    """Like matmul, each element may be a single 4x4 matrix or an (N, 4, 4) stack"""
+    return matmul(mats, out)
+
+
+# Fused translation, rotation and scale.
+# rotation is either Euler angles (x, y, z), composed in the given order like
+# matmul([rotationZ(z), rotationY(y), rotationX(x)]) for "zyx", or a unit
+# quaternion (w, x, y, z). scale is a single value or one per axis.
+# trs is translate * rotation * scale, tsr is translate * scale * rotation.
+
+# Plane of each elementary rotation, see rotationX/Y/Z
+_ROTATION_PLANES = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}
+
+
+def _rotation3(rotation, order):
+    """3x3 rotation as a flat list of 9 Python floats, by rows"""
+
+    if len(rotation) == 4:
+        w, x, y, z = rotation
+        return [
+            1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+            2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+            2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)]
+
+    angles = {"x": rotation[0], "y": rotation[1], "z": rotation[2]}
+    r = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+
+    for axis in order:
+        theta = angles[axis]
+        if theta == 0:
+            continue
+
+        c = math.cos(theta)
+        s = math.sin(theta)
+        i, j = _ROTATION_PLANES[axis]
+
+        # Multiplying by a plane rotation only mixes the columns i and j
+        for row in (0, 3, 6):
+            a = r[row + i]
+            b = r[row + j]
+            r[row + i] = a * c + b * s
+            r[row + j] = b * c - a * s
+
+    return r
+
+
+def _axes(scale):
+    try:
+        sx, sy, sz = scale
+    except TypeError:
+        sx = sy = sz = scale
+    return sx, sy, sz
+
+
+def trs(translation, rotation=(0, 0, 0), scale=1, order="zyx", out=None):
+    tx, ty, tz = translation
+    sx, sy, sz = _axes(scale)
+    r = _rotation3(rotation, order)
+
+    return _matrix((
+        r[0] * sx, r[1] * sy, r[2] * sz, tx,
+        r[3] * sx, r[4] * sy, r[5] * sz, ty,
+        r[6] * sx, r[7] * sy, r[8] * sz, tz,
+        0, 0, 0, 1), out)
+
+
+def tsr(translation, rotation=(0, 0, 0), scale=1, order="zyx", out=None):
+    tx, ty, tz = translation
+    sx, sy, sz = _axes(scale)
+    r = _rotation3(rotation, order)
+
+    return _matrix((
+        r[0] * sx, r[1] * sx, r[2] * sx, tx,
+        r[3] * sy, r[4] * sy, r[5] * sy, ty,
+        r[6] * sz, r[7] * sz, r[8] * sz, tz,
+        0, 0, 0, 1), out)
+
+
+def _rotation3Batch(rotation, order):
+    rotation = np.asarray(rotation, dtype=np.float64)
+    rotation = rotation.reshape((-1, rotation.shape[-1]))
+
+    if rotation.shape[1] == 4:
+        return qt.toMatrix3(rotation)
+
+    out = np.identity(3)
+    for axis in order:
+        out = np.matmul(out, _planeRotation3Batch(rotation[:, "xyz".index(axis)], *_ROTATION_PLANES[axis]))
+    return out.reshape((-1, 3, 3))
+
+
+def _trsBatch(translation, rotation, scale, order, scaleColumns, out):
+    translation = np.reshape(translation, (-1, 3))
+    r = _rotation3Batch(rotation, order)
+
+    # A single (3,) scale is per axis, other 1d scales are uniform, one per element
+    scale = np.asarray(scale)
+    if scale.ndim == 2 or scale.shape == (3,):
+        scale = scale.reshape((-1, 1, 3) if scaleColumns else (-1, 3, 1))
+    else:
+        scale = scale.reshape((-1, 1, 1))
+
+    out = identityBatch(_batchLength(out, translation[:, 0], scale[:, 0, 0], r[:, 0, 0]), out)
+    np.multiply(r, scale, out=out[:, 0:3, 0:3])
+    out[:, 0:3, 3] = translation
+    return out
+
+
+def trsBatch(translation, rotation=(0, 0, 0), scale=1, order="zyx", out=None):
+    """(N, 4, 4) stack of trs, each argument is a single value or one row per element"""
+    return _trsBatch(translation, rotation, scale, order, True, out)
+
+
+def tsrBatch(translation, rotation=(0, 0, 0), scale=1, order="zyx", out=None):
+    """(N, 4, 4) stack of tsr, each argument is a single value or one row per element"""
+    return _trsBatch(translation, rotation, scale, order, False, out)
+
+
+def frustum(left, right, bottom, top, near, far, out=None):
     r_l = right - left
     t_b = top - bottom
     f_n = far - near
-    return np.array([
-        [ 2 * near / r_l,
+    return _matrix((
+        2 * near / r_l,
         0,
         (right + left) / r_l,
-        0],
-        [ 0,
+        0,
+
+        0,
         2 * near / t_b,
         (top + bottom) / t_b,
-        0],
-        [ 0,
+        0,
+
+        0,
         0,
         -(far + near) / f_n,
-        -2 * near * far / f_n],
-        [ 0,
+        -2 * near * far / f_n,
+
+        0,
         0,
         -1,
-        0]], dtype = np.float32)
+        0), out)
 
 
-def perspective(fovy, aspect, near, far):
+def perspective(fovy, aspect, near, far, out=None):
     halfHeight = np.tan(np.pi * fovy / 360) * near
     halfWidth = halfHeight * aspect
-    return frustum(-halfWidth, halfWidth, -halfHeight, halfHeight, near, far)
+    return frustum(-halfWidth, halfWidth, -halfHeight, halfHeight, near, far, out)
 
 
-def ortho(left, right, bottom, top, near, far):
+def ortho(left, right, bottom, top, near, far, out=None):
     r_l = right - left
     t_b = top - bottom
     f_n = far - near
-    return np.array([
-        [ 2 / r_l,
+    return _matrix((
+        2 / r_l,
         0,
         0,
-        -(right + left) / r_l],
-        [ 0,
+        -(right + left) / r_l,
+
+        0,
         2 / t_b,
         0,
-        -(top + bottom) / t_b],
-        [ 0,
+        -(top + bottom) / t_b,
+
+        0,
         0,
         -2 / f_n,
-        -(far + near) / f_n],
-        [ 0,
+        -(far + near) / f_n,
+
+        0,
         0,
         0,
-        1]], dtype = np.float32)
+        1), out)
 
 
-def lookAt(eye, at, up):
+def lookAt(eye, at, up, out=None):
 
     forward = (at - eye)
     forward = forward / np.linalg.norm(forward)
@@ -212,9 +483,9 @@ def lookAt(eye, at, up):
     newUp = np.cross(side, forward)
     newUp = newUp / np.linalg.norm(newUp)
 
-    return np.array([
-            [side[0],       side[1],    side[2], -np.dot(side, eye)],
-            [newUp[0],     newUp[1],   newUp[2], -np.dot(newUp, eye)],
-            [-forward[0], -forward[1], -forward[2], np.dot(forward, eye)],
-            [0,0,0,1]
-        ], dtype = np.float32)
+    return _matrix((
+            side[0],       side[1],    side[2], -np.dot(side, eye),
+            newUp[0],     newUp[1],   newUp[2], -np.dot(newUp, eye),
+            -forward[0], -forward[1], -forward[2], np.dot(forward, eye),
+            0,0,0,1
+        ), out)
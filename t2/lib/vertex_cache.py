@@ -0,0 +1,152 @@
+# coding=utf-8
+"""Triangle and vertex reordering for the post-transform vertex cache"""
+
+from collections import deque
+import numpy as np
+
+from lib.shapes import Shape as _Shape
+
+# Typical size of the FIFO post-transform cache simulated to measure and optimize
+CACHE_SIZE = 32
+
+
+def acmr(indices, cacheSize=CACHE_SIZE):
+    """Average cache miss ratio: transformed vertices per triangle with a FIFO cache"""
+
+    indices = np.asarray(indices).reshape(-1).tolist()
+    if len(indices) == 0:
+        return 0.0
+
+    fifo = deque()
+    cached = set()
+    misses = 0
+
+    for index in indices:
+        if index not in cached:
+            misses += 1
+            fifo.append(index)
+            cached.add(index)
+            if len(fifo) > cacheSize:
+                cached.discard(fifo.popleft())
+
+    return misses / (len(indices) // 3)
+
+
+def tipsify(indices, vertexCount, cacheSize=CACHE_SIZE):
+    """Reorders triangles for vertex cache locality.
+
+    Linear time algorithm from Sander, Nehab and Barczak,
+    "Fast Triangle Reordering for Vertex Locality and Reducing Overdraw" (2007).
+    Returns the new index array, same triangles in a different order.
+    """
+
+    triangles = np.asarray(indices, dtype=np.int64).reshape((-1, 3))
+    triangleCount = len(triangles)
+
+    # Vertex to triangles adjacency in compressed rows
+    corners = triangles.reshape(-1)
+    order = np.argsort(corners, kind='stable')
+    adjacency = (order // 3).tolist()
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(corners, minlength=vertexCount)))).tolist()
+
+    liveTriangles = np.bincount(corners, minlength=vertexCount).tolist()
+    cacheTime = [0] * vertexCount
+    emitted = [False] * triangleCount
+    triangleList = triangles.tolist()
+
+    deadEnd = []
+    output = []
+    time = cacheSize + 1
+    cursor = 0
+
+    fanning = 0 if triangleCount > 0 else -1
+    while fanning >= 0:
+        candidates = set()
+
+        for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+
+            for v in triangleList[t]:
+                output.append(v)
+                deadEnd.append(v)
+                candidates.add(v)
+                liveTriangles[v] -= 1
+
+                if time - cacheTime[v] > cacheSize:
+                    cacheTime[v] = time
+                    time += 1
+
+            emitted[t] = True
+
+        # Next fanning vertex: among the candidates with live triangles, the one used longest ago
+        # that stays in cache while its remaining triangles are emitted; the rest score 0
+        fanning = -1
+        best = -1
+        for v in candidates:
+            if liveTriangles[v] > 0:
+                priority = 0
+                if time - cacheTime[v] + 2 * liveTriangles[v] <= cacheSize:
+                    priority = time - cacheTime[v]
+                if priority > best:
+                    best = priority
+                    fanning = v
+
+        # Dead end, backtracking through recently used vertices or scanning the rest
+        if fanning == -1:
+            while deadEnd:
+                v = deadEnd.pop()
+                if liveTriangles[v] > 0:
+                    fanning = v
+                    break
+
+        if fanning == -1:
+            while cursor < vertexCount:
+                if liveTriangles[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+
+    return np.asarray(output, dtype=np.uint32)
+
+
+def optimizeVertexCache(shape, stride, cacheSize=CACHE_SIZE, submeshes=None, report=False):
+    """Returns a copy of an indexed triangle shape reordered for the GPU.
+
+    Triangles are reordered with tipsify for post-transform cache hits,
+    then vertices are renumbered by first use for fetch locality.
+    Vertices not referenced by any triangle are kept at the end.
+    submeshes: index ranges (obj_handler.Submesh) drawn separately, triangles
+    are only reordered inside their own range so the ranges stay valid.
+    report: prints the ACMR before and after.
+    """
+
+    vertexData = np.asarray(shape.vertices, dtype=np.float32).reshape((-1, stride))
+    indices = np.asarray(shape.indices, dtype=np.int64).reshape(-1)
+
+    assert len(indices) % 3 == 0, "Only triangle lists can be optimized."
+
+    if submeshes is None:
+        newIndices = tipsify(indices, len(vertexData), cacheSize).astype(np.int64)
+    else:
+        newIndices = indices.copy()
+        for submesh in submeshes:
+            assert submesh.start % 3 == 0 and submesh.count % 3 == 0, "Submeshes must be whole triangles."
+            end = submesh.start + submesh.count
+            newIndices[submesh.start:end] = tipsify(indices[submesh.start:end], len(vertexData), cacheSize)
+
+    # Vertices are stored in the order the triangles first use them
+    _, firstUse = np.unique(newIndices, return_index=True)
+    used = newIndices[np.sort(firstUse)]
+    unused = np.setdiff1d(np.arange(len(vertexData)), used)
+    vertexOrder = np.concatenate((used, unused))
+
+    remap = np.empty(len(vertexData), dtype=np.int64)
+    remap[vertexOrder] = np.arange(len(vertexData))
+
+    optimized = _Shape(vertexData[vertexOrder].reshape(-1), remap[newIndices].astype(np.uint32))
+
+    if report:
+        print(f"ACMR (cache of {cacheSize}): {acmr(indices, cacheSize):.3f} -> {acmr(optimized.indices, cacheSize):.3f}")
+
+    return optimized
@@ -0,0 +1,125 @@
+# coding=utf-8
+"""Vertex format descriptors, to upload vertices with compact attribute types"""
+
+from OpenGL.GL import *
+import numpy as np
+
+# Float layouts used by the shapes of this library, as (attribute name, components)
+POSITION_COLOR = [("position", 3), ("color", 3)]
+POSITION_TEXTURE = [("position", 3), ("texCoords", 2)]
+POSITION_COLOR_NORMAL = [("position", 3), ("color", 3), ("normal", 3)]
+POSITION_TEXTURE_NORMAL = [("position", 3), ("texCoords", 2), ("normal", 3)]
+
+
+def _padded(size):
+    # Attribute offsets are kept 4 bytes aligned
+    return (size + 3) // 4 * 4
+
+
+def _encodeFloat(values):
+    return values.astype(np.float32)
+
+
+def _encodeHalf(values):
+    return values.astype(np.float16)
+
+
+def _encodeUnsignedByte(values):
+    return np.round(np.clip(values, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _encodeShort(values):
+    return np.round(np.clip(values, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def _encodeInt2101010(values):
+    """Packs xyz in [-1, 1] into signed 10 bit fields of one 32 bit word, w is left as 0"""
+    fields = np.round(np.clip(values, -1.0, 1.0) * 511).astype(np.int32) & 0x3FF
+    packed = fields[:, 0] | (fields[:, 1] << 10) | (fields[:, 2] << 20)
+    return packed.astype(np.int32)[:, None]
+
+
+class VertexAttribute:
+    """How one attribute is stored: GL type, components read by GL, normalization and byte offset"""
+
+    def __init__(self, name, components, glType, glComponents, normalized, size, encoder):
+        self.name = name
+        self.components = components
+        self.glType = glType
+        self.glComponents = glComponents
+        self.normalized = normalized
+        self.size = size
+        self.encoder = encoder
+        self.offset = 0
+
+
+class VertexFormat:
+    """
+    Describes how the float vertices of a shape are stored in the VBO.
+    layout lists the (attribute name, components) of the float vertices,
+    attribute names must match the ones used by the shader programs.
+    compact=False stores 32 bits floats, like GPUShape.fillBuffers does.
+    compact=True stores positions and texture coordinates as half floats,
+    normals as GL_INT_2_10_10_10_REV and colors as normalized bytes,
+    which is about half the memory. With packedNormals=False normals are
+    normalized 16 bits integers instead, more precise but 8 bytes long.
+    """
+
+    def __init__(self, layout, compact=False, packedNormals=True):
+        self.layout = layout
+        self.compact = compact
+        self.packedNormals = packedNormals
+        self.floatsPerVertex = sum(components for _, components in layout)
+        self.attributes = [self._attribute(name, components) for name, components in layout]
+
+        offset = 0
+        for attribute in self.attributes:
+            attribute.offset = offset
+            offset += _padded(attribute.size)
+        self.stride = offset
+
+    def _attribute(self, name, components):
+        if not self.compact:
+            return VertexAttribute(name, components, GL_FLOAT, components, GL_FALSE, 4 * components, _encodeFloat)
+
+        if name == "normal":
+            if self.packedNormals and components == 3:
+                return VertexAttribute(name, components, GL_INT_2_10_10_10_REV, 4, GL_TRUE, 4, _encodeInt2101010)
+            return VertexAttribute(name, components, GL_SHORT, components, GL_TRUE, 2 * components, _encodeShort)
+
+        if name == "color":
+            return VertexAttribute(name, components, GL_UNSIGNED_BYTE, components, GL_TRUE, components, _encodeUnsignedByte)
+
+        return VertexAttribute(name, components, GL_HALF_FLOAT, components, GL_FALSE, 2 * components, _encodeHalf)
+
+    def pack(self, vertices):
+        """Converts flat float vertices into the raw bytes to upload"""
+        vertices = np.asarray(vertices, dtype=np.float32).reshape((-1, self.floatsPerVertex))
+        packed = np.zeros((len(vertices), self.stride), dtype=np.uint8)
+
+        column = 0
+        for attribute in self.attributes:
+            encoded = attribute.encoder(vertices[:, column:column + attribute.components])
+            encoded = np.ascontiguousarray(encoded).view(np.uint8)
+            packed[:, attribute.offset:attribute.offset + encoded.shape[1]] = encoded
+            column += attribute.components
+
+        return packed.reshape(-1)
+
+    def setupVAO(self, shaderProgram, gpuShape):
+        """Same job as the setupVAO of the shader programs, with the pointers described here"""
+        glBindVertexArray(gpuShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, gpuShape.ebo)
+
+        for attribute in self.attributes:
+            location = glGetAttribLocation(shaderProgram, attribute.name)
+            if location < 0:
+                continue
+            glVertexAttribPointer(location, attribute.glComponents, attribute.glType, attribute.normalized,
+                self.stride, ctypes.c_void_p(attribute.offset))
+            glEnableVertexAttribArray(location)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
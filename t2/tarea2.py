@@ -1,16 +1,21 @@
+import os
 from pyglet.window import Window, key
 from pyglet.app import run
 from pyglet.clock import schedule, schedule_interval
 import numpy as np
 from OpenGL.GL import *
 import lib.transformations as tr
+import lib.quaternions as qt
 import lib.gpu_shape as gs
 import lib.scene_graph as sg
 import lib.easy_shaders as es
 import lib.basic_shapes as bs
-import lib.shaders as sh
 from lib.assets_path import getAssetPath
 from lib.obj_handler import read_OBJ2
+from lib.mesh_cache import load_cached
+from lib.asset_loader import AssetPreloader
+from lib.texture_manager import TextureManager
+from lib.texture_atlas import packTextureArray, InstanceBatch
 
 #window and camera configs
 WIDTH, HEIGHT = 1000, 700
@@ -23,6 +28,9 @@ PROJECTIONS = [
     tr.ortho(-8, 8, -8, 8, 0.1, 100)  # ORTOGRAPHIC_PROJECTION
 ]
 
+#loading reports are printed only when running with TAREA2_REPORTS=1
+REPORTS = os.environ.get("TAREA2_REPORTS") == "1"
+
 #assets
 ASSETS = {
     "bg_tex": getAssetPath("background3.png"),
@@ -40,6 +48,22 @@ ASSETS = {
     "planet_text": getAssetPath("planet_tex.png")
 }
 
+#meshes are parsed and images decoded in background threads while the window and pipelines are created,
+#GPU uploads still happen below, on the thread owning the GL context
+preloader = AssetPreloader()
+for assetName, assetPath in ASSETS.items():
+    if assetPath.endswith(".obj"):
+        preloader.addMesh(assetName, load_cached, read_OBJ2, assetPath, indexed=True)
+    else:
+        #decoded pixels are cached raw, the background with its mip chain
+        preloader.addTexture(assetName, assetPath, mipmaps=(assetName == "bg_tex"))
+
+#textures are shared by file and sampling parameters, e.g. shadow.png is uploaded once for every shadow
+textures = TextureManager()
+
+def assetTexture(gpuShape, assetName, params, **upload):
+    textures.assign(gpuShape, ASSETS[assetName], *params, image=preloader.texture(assetName), **upload)
+
 
 
 class Controller(Window):
@@ -90,6 +114,8 @@ class Camera:
         initial "up" vector for the camera projection
     avaible_projections : list
         list that contains the transformations for orthographic and perspective projections 
+    view : numpy.array
+        view matrix, rewritten in place every frame
         
     Methods
     -------
@@ -115,6 +141,7 @@ class Camera:
         self.up0 = up
         self.available_projections = PROJECTIONS
         self.projection = self.available_projections[1]
+        self.view = tr.identity()
 
     def set_projection(self, projection_index):
         """
@@ -273,6 +300,8 @@ class Airship:
         stores the azimuthal angle of rotation of the airship
     theta : float
         stores the zenithal angle of rotation of the airship
+    orientation : numpy.array
+        stores the attitude of the airship as a unit quaternion (w,x,y,z)
     
     
     Methods
@@ -304,6 +333,7 @@ class Airship:
         self.phi = 0 #
         self.theta = 0 #zenital
 
+        self.orientation = qt.identity()
         
     def update(self):
         self.angleZ += (self.angleZSpeed * self.angleZMultiplier) #SIDES
@@ -350,6 +380,9 @@ class Airship:
                 self.angleY += abs(self.angleY) * 2
                 self.angleZ += np.pi
                 self.translateVector[2] += 0.2
+
+        # pitch around x, then heading around z
+        self.orientation = qt.fromEuler((self.angleY, 0, self.angleZ))
                    
     def updateCoords(self, X=False, Y =False, Z = False):
         """
@@ -487,86 +520,74 @@ schedule_interval(update, 0.01)
         
 ## scenegraph
 #airship obj
-airshipObj = gs.createGPUShape(objPipeline, read_OBJ2(ASSETS["airship_obj"]))
+airshipObj = gs.createGPUShape(objPipeline, preloader.mesh("airship_obj"), optimize=True)
 AOtex_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-airshipTex = ASSETS["airship_text"]
-airshipObj.texture = es.textureSimpleSetup(airshipTex, *AOtex_params)
+assetTexture(airshipObj, "airship_text", AOtex_params)
 
 #ring obj
-ringObj = gs.createGPUShape(objPipeline, read_OBJ2(ASSETS["ring_obj"]))
+ringObj = gs.createGPUShape(objPipeline, preloader.mesh("ring_obj"), optimize=True)
 ringtex_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-ringTex = ASSETS["ring_tex"]
-ringObj.texture = es.textureSimpleSetup(ringTex, *ringtex_params)
+assetTexture(ringObj, "ring_tex", ringtex_params)
 ringObjNode = sg.SceneGraphNode("ringobjnode")
 ringObjNode.childs += [ringObj]
 
 #shadow obj
-ringShadow = gs.createGPUShape(objPipeline,read_OBJ2(ASSETS["ringShadow_obj"]))
+ringShadow = gs.createGPUShape(objPipeline, preloader.mesh("ringShadow_obj"), optimize=True)
 sR_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-srTex = ASSETS["shadow_tex"]
-ringShadow.texture = es.textureSimpleSetup(srTex, *sR_params)
+assetTexture(ringShadow, "shadow_tex", sR_params)
 ringNode = sg.SceneGraphNode("ringShadow_node")
 ringNode.childs += [ringShadow]
 
 #airship node
 objNode = sg.SceneGraphNode("airshipNode")
-objNode.transform = tr.matmul([tr.translate(0,0,3),tr.rotationX(np.pi / 2),tr.scale(0.3,0.3,0.3)])
+objNode.transform = tr.trs((0,0,3), (np.pi / 2,0,0), 0.3)
 objNode.childs += [airshipObj]
 
-#escenary with texture
-rockTex_TexCords = [1.0,1.0]
-rockCube = gs.createGPUShape(texPipeline, bs.createCube(*rockTex_TexCords))
-rockCube_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-rockTex = ASSETS["rock1_tex"]
-rockCube.texture = sh.textureSimpleSetup(rockTex, *rockCube_params)
+#escenary with texture: every textured cube of the background is one layer of a texture array
+#over the same geometry, so the whole set is drawn with a single instanced call.
+#The cube leaves only mark what to draw, they share the batch buffers and have no texture of their own
+geometry = gs.GeometryRegistry()
+cubePipeline = es.TextureArrayInstancedShaderProgram()
+cubeLayers = ["rock1_tex", "rock2_tex", "rock3_tex", "planet_text", "satelite_tex", "shadow_tex"]
+cubeTextures = packTextureArray({name: preloader.texture(name) for name in cubeLayers}, GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST, mipmaps=False)
+cubeBatch = InstanceBatch(cubePipeline, geometry.instance(cubePipeline, bs.createCube, 1.0, 1.0), cubeTextures)
 
-rockTex_TexCords2 = [1.0,1.0]
-rockCube2 = gs.createGPUShape(texPipeline, bs.createCube(*rockTex_TexCords2))
-rockCube_params2 = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-rockTex2 = ASSETS["rock2_tex"]
-rockCube2.texture = sh.textureSimpleSetup(rockTex2, *rockCube_params2)
+def batchedCube(layerName):
+    leaf = geometry.instance(cubePipeline, bs.createCube, 1.0, 1.0)
+    cubeBatch.assign(leaf, layerName)
+    return leaf
 
-gpurockCube3 = gs.createGPUShape(texPipeline, bs.createCube(*[1.0,1.0]))
-gpurockCube3.texture = sh.textureSimpleSetup(ASSETS["rock3_tex"], *rockCube_params2)               
+rockCube = batchedCube("rock1_tex")
+rockCube2 = batchedCube("rock2_tex")
+gpurockCube3 = batchedCube("rock3_tex")
 
 rockCube3 = sg.SceneGraphNode("rockCubeModel")
 rockCube3.transform = tr.scale(0.15,0.15,0.20)
 rockCube3.childs += [gpurockCube3]
 
-planetCoords = [1.0,1.0]
-gpuPlanet = gs.createGPUShape(texPipeline, bs.createCube(*planetCoords))
-planetParams = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-planetTex = ASSETS["planet_text"]
-gpuPlanet.texture = sh.textureSimpleSetup(planetTex, *planetParams)
+gpuPlanet = batchedCube("planet_text")
 
 gpuPlanetNode = sg.SceneGraphNode("planetNode")
 gpuPlanetNode.childs += [gpuPlanet]
 
-sateliteCoords = [1.0,1.0]
-gpuSatelite = gs.createGPUShape(texPipeline, bs.createCube(*sateliteCoords))
-sateliteParams = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-sateliteTex = ASSETS["satelite_tex"]
-gpuSatelite.texture = sh.textureSimpleSetup(sateliteTex, *sateliteParams)
+gpuSatelite = batchedCube("satelite_tex")
           
 gpuSateliteNode = sg.SceneGraphNode("gpuSateliteNode")
 gpuSateliteNode.childs = [gpuSatelite]
      
 #shadow for rocks
-shadowCube = gs.createGPUShape(texPipeline, bs.createCube(*[1.0,1.0]))
-shadowCube_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-shadowCubeTex = ASSETS["shadow_tex"]
-shadowCube.texture = sh.textureSimpleSetup(shadowCubeTex, *shadowCube_params)
+shadowCube = batchedCube("shadow_tex")
 
 #background cube tex
 bgCube_TexCoords = [40.0, 40.0]
 bgCube = gs.createGPUShape(texPipeline, bs.createTextureQuad(*bgCube_TexCoords))
-bgCube_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-bgCube_Tex = ASSETS["bg_tex"]
-bgCube.texture = sh.textureSimpleSetup(bgCube_Tex, *bgCube_params)
+#tiled 40 times, the background is minified a lot and needs mipmaps to avoid aliasing
+bgCube_params = [GL_REPEAT, GL_REPEAT, GL_LINEAR_MIPMAP_LINEAR, GL_LINEAR]
+assetTexture(bgCube, "bg_tex", bgCube_params, mipmaps="cpu", compressed=True)
 
 #background cube node
 bgNode = sg.SceneGraphNode("bgNode")
-bgNode.transform = tr.matmul([tr.translate(0,0,-5),tr.scale(200,200,1)])
+bgNode.transform = tr.trs((0,0,-5), scale=(200,200,1))
 bgNode.childs += [bgCube]
 
 #node that the camera follows
@@ -574,13 +595,15 @@ cameraPos = sg.SceneGraphNode("cameraPos")
 
 #following airships
 a1 = sg.SceneGraphNode("airship_1")
+a1.transform = tr.translate(-1.2,-1.2,0.2)
 a1.childs += [objNode]
 
 a2 = sg.SceneGraphNode("airship_2")
+a2.transform = tr.translate(1.2,-1.2,0.2)
 a2.childs += [objNode]
 
 #airship movement node
-airshipRotation = sg.SceneGraphNode("airshipRotation")
+airshipRotation = sg.QuaternionNode("airshipRotation")
 airshipRotation.childs += [objNode]
 airshipRotation.childs += [cameraPos]
 
@@ -660,14 +683,15 @@ movingRock3 = sg.SceneGraphNode("movingRock3")
 movingRock3.childs += [rockCube3]
 
 
-ring1 = sg.SceneGraphNode("ring1")
+#rings keep their placement cached, only the oscillation is animated
+ring1 = sg.ComposedNode("ring1", [tr.translate(10,17, 5), tr.rotationX(np.pi / 2),tr.scale(0.6,0.7,0.4)])
 ring1.childs += [ringObjNode]
-ringShadow1 = sg.SceneGraphNode("ringShadow1")
+ringShadow1 = sg.ComposedNode("ringShadow1", [tr.translate(10,17,1),tr.rotationX(np.pi / 2),tr.scale(0.6,0.7,0.4)])
 ringShadow1.childs += [ringNode]
 
-ring2 = sg.SceneGraphNode("ring2")
+ring2 = sg.ComposedNode("ring2", [tr.translate(12,-22, 4), tr.rotationX(np.pi / 2),tr.rotationY(np.pi / 2),tr.scale(0.6,0.7,0.4)])
 ring2.childs += [ringObjNode]
-ringShadow2 = sg.SceneGraphNode("ringShadow2")
+ringShadow2 = sg.ComposedNode("ringShadow2", [tr.translate(12,-22,0),tr.rotationX(np.pi / 2),tr.rotationY(np.pi / 2),tr.scale(0.6,0.7,0.4)])
 ringShadow2.childs += [ringNode]
 
 rings = sg.SceneGraphNode("rings")
@@ -729,14 +753,45 @@ bgRoot.childs += [movingRock3]
 bgRoot.childs += [planetPos]
 bgRoot.childs += [planetShadow]
 
+#static rocks: position, scale, initial angle and rotation group (time.r1Rotation or time.r2Rotation),
+#shadows lie 4 units below their rock, flattened
+rockNodes = [rock1, rock2, rock3, rock4, rock5, rock6, rock7, rock8, rock9, rock10]
+rockShadowNodes = [rockShadow1, rockShadow2, rockShadow3, rockShadow4, rockShadow5,
+    rockShadow6, rockShadow7, rockShadow8, rockShadow9, rockShadow10]
+ROCK_POSITIONS = np.array([[10,5,4], [20,15,5], [5,-9,6], [10,13,6], [-10,12,6],
+    [-2,12,5], [5,-7,5], [20,-7,5], [5,-18,5], [-20,-7,5]], dtype=np.float32)
+ROCK_SCALES = np.array([[0.2,0.2,0.3], [0.25,0.25,0.35], [0.25,0.25,0.35], [0.3,0.3,0.4], [0.2,0.2,0.3],
+    [0.5,0.5,0.65], [0.6,0.6,0.75], [0.6,0.6,0.75], [0.4,0.4,0.55], [0.3,0.3,0.35]], dtype=np.float32)
+ROCK_ANGLES = np.pi * np.array([5/6, 5/2, 2/3, 7/5, 3/5, 1/5, 9/5, 9/5, 9/5, 9/5])
+ROCK_GROUPS = np.array([1, 1, 1, 1, 1, 2, 2, 2, 2, 2])
+
+#the fixed translation and scale of every rock and shadow are multiplied once,
+#rock nodes keep views of the stacks that are rewritten in place every frame
+rockPlacements = tr.matmulBatch([tr.translateBatch(*ROCK_POSITIONS.T), tr.scaleBatch(*ROCK_SCALES.T)])
+rockShadowPlacements = tr.matmulBatch([tr.translateBatch(ROCK_POSITIONS[:,0], ROCK_POSITIONS[:,1], ROCK_POSITIONS[:,2] - 4),
+    tr.scaleBatch(ROCK_SCALES[:,0], ROCK_SCALES[:,1], 0.01)])
+rockAngles = np.empty(len(rockNodes))
+rockInGroup1 = ROCK_GROUPS == 1
+rockRotations = tr.identityBatch(len(rockNodes))
+rockTransforms = tr.identityBatch(len(rockNodes))
+rockShadowTransforms = tr.identityBatch(len(rockShadowNodes))
+for node, transform in zip(rockNodes, rockTransforms):
+    node.transform = transform
+for node, transform in zip(rockShadowNodes, rockShadowTransforms):
+    node.transform = transform
+
 #shadow png
-gpuShadow = gs.createGPUShape(objPipeline, read_OBJ2(ASSETS["shadow_obj"]))
+gpuShadow = gs.createGPUShape(objPipeline, preloader.mesh("shadow_obj"), optimize=True)
 shadowTex_params = [GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST]
-shadowTex = ASSETS["shadow_tex"]
-gpuShadow.texture = sh.textureSimpleSetup(shadowTex, *shadowTex_params)
+assetTexture(gpuShadow, "shadow_tex", shadowTex_params)
+
+if REPORTS:
+    preloader.report()
+    textures.report()
+preloader.shutdown()
 
 shadowObj = sg.SceneGraphNode("shadowObj")
-shadowObj.transform = tr.matmul([tr.rotationX(np.pi / 2),tr.rotationY(0),tr.scale(0.4,0.4,0.4)])
+shadowObj.transform = tr.trs((0,0,0), (np.pi / 2,0,0), 0.4)
 shadowObj.childs += [gpuShadow]
 
 shadowPos = sg.SceneGraphNode("shadowRot")
@@ -780,7 +835,8 @@ def on_draw():
     view = tr.lookAt(
         camera.eye,
         camera.at,
-        camera.up
+        camera.up,
+        out=camera.view
     )
     
     glUniformMatrix4fv(glGetUniformLocation(objPipeline.shaderProgram, "projection"), 1, GL_TRUE, camera.projection)
@@ -789,55 +845,44 @@ def on_draw():
     
     #airships movement
     a0.update()
-    airshipRotation.transform = tr.matmul([tr.rotationZ(a0.angleZ), tr.rotationX(a0.angleY)])
-    airshipTranslation.transform = tr.translate(a0.translateVector[0], a0.translateVector[1], a0.translateVector[2] + (time.oscillation))
-    cameraPos.transform = tr.translate(a0.translateVector[0], a0.translateVector[1], a0.translateVector[2])
-    shadow.transform = airshipRotation.transform
-    a1Shadow.transform = a2Shadow.transform = tr.matmul([tr.rotationZ(-a0.angleZ)])
-    
-    
-    a1.transform = tr.matmul([tr.translate(-1.2,-1.2,0.2)])
-    a2.transform = tr.matmul([tr.translate(1.2,-1.2,0.2)])
+    airshipRotation.rotation = a0.orientation
+    tr.translate(a0.translateVector[0], a0.translateVector[1], a0.translateVector[2] + (time.oscillation), out=airshipTranslation.transform)
+    tr.translate(a0.translateVector[0], a0.translateVector[1], a0.translateVector[2], out=cameraPos.transform)
+    np.copyto(shadow.transform, airshipRotation.transform)
+    tr.rotationZ(-a0.angleZ, out=a1Shadow.transform)
+    np.copyto(a2Shadow.transform, a1Shadow.transform)
 
 
     
     #scenary
-    rock1.transform = tr.matmul([tr.translate(10,5,4),tr.scale(0.2,0.2,0.3), tr.rotationZ((np.pi * 5/6) + time.r1Rotation)])
-    rockShadow1.transform = tr.matmul([tr.translate(10,5,0),tr.scale(0.2,0.2,0.01), tr.rotationZ((np.pi * 5/6) + time.r1Rotation)]) 
-    rock2.transform = tr.matmul([tr.translate(20,15,5),tr.scale(0.25,0.25,0.35),tr.rotationZ((np.pi * 5/2) + time.r1Rotation)])
-    rockShadow2.transform =tr.matmul([tr.translate(20,15,1),tr.scale(0.25,0.25,0.01),tr.rotationZ((np.pi * 5/2) + time.r1Rotation)])
-    rock3.transform = tr.matmul([tr.translate(5,-9,6),tr.scale(0.25,0.25,0.35),tr.rotationZ((np.pi * 2/3) + time.r1Rotation)])
-    rockShadow3.transform = tr.matmul([tr.translate(5,-9,2),tr.scale(0.25,0.25,0.01),tr.rotationZ((np.pi * 2/3) + time.r1Rotation)])
-    rock4.transform = tr.matmul([tr.translate(10,13,6),tr.scale(0.3,0.3,0.4), tr.rotationZ((np.pi * 7/5) + time.r1Rotation)])
-    rockShadow4.transform = tr.matmul([tr.translate(10,13,2),tr.scale(0.3,0.3,0.01), tr.rotationZ((np.pi * 7/5) + time.r1Rotation)])
-    rock5.transform = tr.matmul([tr.translate(-10,12,6),tr.scale(0.2,0.2,0.3), tr.rotationZ((np.pi * 3 / 5) + time.r1Rotation)])
-    rockShadow5.transform = tr.matmul([tr.translate(-10,12,2),tr.scale(0.2,0.2,0.01), tr.rotationZ((np.pi * 3 / 5) + time.r1Rotation)])
-    rock6.transform = tr.matmul([tr.translate(-2,12,5),tr.scale(0.5,0.5,0.65), tr.rotationZ((np.pi * 1 / 5) + time.r2Rotation)])
-    rockShadow6.transform = tr.matmul([tr.translate(-2,12,1),tr.scale(0.5,0.5,0.01), tr.rotationZ((np.pi * 1 / 5) + time.r2Rotation)])
-    rock7.transform = tr.matmul([tr.translate(5,-7,5),tr.scale(0.6,0.6,0.75), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rockShadow7.transform = tr.matmul([tr.translate(5,-7,1),tr.scale(0.6,0.6,0.01), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rock8.transform = tr.matmul([tr.translate(20,-7,5),tr.scale(0.6,0.6,0.75), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rockShadow8.transform = tr.matmul([tr.translate(20,-7,1),tr.scale(0.6,0.6,0.01), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rock9.transform = tr.matmul([tr.translate(5,-18,5),tr.scale(0.4,0.4,0.55), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rockShadow9.transform = tr.matmul([tr.translate(5,-18,1),tr.scale(0.4,0.4,0.01), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rock10.transform = tr.matmul([tr.translate(-20,-7,5),tr.scale(0.3,0.3,0.35), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
-    rockShadow10.transform = tr.matmul([tr.translate(-20,-7,1),tr.scale(0.3,0.3,0.01), tr.rotationZ((np.pi * 9 / 5) + time.r2Rotation)])
+    #every rock and its shadow are updated at once, shadows share the rotation of their rock
+    np.add(ROCK_ANGLES, time.r2Rotation, out=rockAngles)
+    np.add(ROCK_ANGLES, time.r1Rotation, out=rockAngles, where=rockInGroup1)
+    tr.rotationZBatch(rockAngles, out=rockRotations)
+    tr.matmulBatch([rockPlacements, rockRotations], out=rockTransforms)
+    tr.matmulBatch([rockShadowPlacements, rockRotations], out=rockShadowTransforms)
     
-    ring1.transform = tr.matmul([tr.translate(10,17, 5), tr.rotationX(np.pi / 2),tr.scale(0.6,0.7,0.4),tr.translate(0,time.ringOscillation,0)])
-    ringShadow1.transform = tr.matmul([tr.translate(10,17,1),tr.rotationX(np.pi / 2),tr.scale(0.6,0.7,0.4),tr.translate(0,time.ringOscillation,0)])
-    ring2.transform = tr.matmul([tr.translate(12,-22, 4), tr.rotationX(np.pi / 2),tr.rotationY(np.pi / 2),tr.scale(0.6,0.7,0.4),tr.translate(0,time.ringOscillation,0)])
-    ringShadow2.transform = tr.matmul([tr.translate(12,-22,0),tr.rotationX(np.pi / 2),tr.rotationY(np.pi / 2),tr.scale(0.6,0.7,0.4),tr.translate(0,time.ringOscillation,0)])
-
-    movingRock1.transform = tr.matmul([tr.translate(time.rock1X,-35 + (time.movingRockTr1 % 65),0),tr.rotationX(time.movingRockRotation)])
-    movingRock2.transform = tr.matmul([tr.translate(time.rock2X,-35 + (time.movingRockTr2 % 65),0),tr.rotationX(time.movingRockRotation)])
-    movingRock3.transform = tr.matmul([tr.translate(time.rock3X,-35 + (time.movingRockTr3 % 65),0),tr.rotationX(time.movingRockRotation)])
-
-    planetPos.transform = tr.matmul([tr.translate(-18,-20,2),tr.rotationZ(time.planetRot),tr.scale(1,1,1.5)])
-    satelitePos.transform = tr.matmul([tr.translate(2,0,0),tr.rotationZ(time.sateliteRot),tr.scale(0.2,0.2,0.2)])
-    sateliteShadow.transform = tr.matmul([tr.translate(2,0,-3),tr.rotationZ(time.sateliteRot),tr.scale(0.2,0.2,0.001)])
-    planetShadow.transform = tr.matmul([tr.translate(-18,-20,-1),tr.rotationZ(time.planetRot),tr.scale(1,1,0.001)])
+    for ring in (ring1, ringShadow1, ring2, ringShadow2):
+        tr.translate(0,time.ringOscillation,0, out=ring.animated)
+        ring.update()
+
+    tr.trs((time.rock1X,-35 + (time.movingRockTr1 % 65),0), (time.movingRockRotation,0,0), out=movingRock1.transform)
+    tr.trs((time.rock2X,-35 + (time.movingRockTr2 % 65),0), (time.movingRockRotation,0,0), out=movingRock2.transform)
+    tr.trs((time.rock3X,-35 + (time.movingRockTr3 % 65),0), (time.movingRockRotation,0,0), out=movingRock3.transform)
+
+    tr.trs((-18,-20,2), (0,0,time.planetRot), (1,1,1.5), out=planetPos.transform)
+    tr.trs((2,0,0), (0,0,time.sateliteRot), 0.2, out=satelitePos.transform)
+    tr.trs((2,0,-3), (0,0,time.sateliteRot), (0.2,0.2,0.001), out=sateliteShadow.transform)
+    tr.trs((-18,-20,-1), (0,0,time.planetRot), (1,1,0.001), out=planetShadow.transform)
     
-    sg.drawSceneGraphNode(bgRoot, texPipeline, "model")
+    sg.drawSceneGraphNode(bgRoot, texPipeline, "model", batch=cubeBatch)
+
+    glUseProgram(cubePipeline.shaderProgram)
+    glUniformMatrix4fv(glGetUniformLocation(cubePipeline.shaderProgram, "projection"), 1, GL_TRUE, camera.projection)
+    glUniformMatrix4fv(glGetUniformLocation(cubePipeline.shaderProgram, "view"), 1, GL_TRUE, view)
+    cubeBatch.draw()
+    glUseProgram(texPipeline.shaderProgram)
+
     sg.drawSceneGraphNode(sceneRoot, objPipeline, "model")
 
     